@@ -1,49 +1,58 @@
-import matplotlib.pyplot as plt
-from datetime import date, timedelta
-from db import get_streak_data, get_all_counter_data, get_habit_info
+from datetime import date
+from checkoff import decide, days_between
+from db import iter_streaks, get_all_counter_data, get_habit_info, get_habit_stats, get_longest_streak
+from metrics import instrument
 
 
-def streak_analysis(db, name):
+def streak_analysis(db, name, chart=True):
     """
     Analyzes streak data for a specific habit or all habits, presenting the longest streak
     and optionally visualizing streak history with a bar chart.
 
+    The longest streak is read from the maintained habit_stats table, so only the history needs the streak rows.
+
     :param db: An initialized sqlite3 database connection.
     :param name: The name of the habit to analyze, or "Overall" for analyzing all habits.
+    :param chart: If True, the streak history of a habit is shown as a bar chart, otherwise it is printed.
     :return: None. Outputs analysis results to console and optionally displays a bar chart.
     """
-    streak_data = get_streak_data(db, name)
-
-    # Check if there is any streak data available
-    if not streak_data:
-        print("No streak data found.")
-        return  # Early return if no data is found
-
-    # Extracting all dates and streak lengths into lists
-    all_dates = [streak[0] for streak in streak_data]
-    all_lengths = [streak[2] for streak in streak_data]
-
-    # Finding the longest streak and its index
-    max_length = max(all_lengths)
-    index = all_lengths.index(max_length)
-
     if name == "Overall":
-        # Extracting all habit names for "Overall" analysis
-        all_habits = [streak[1] for streak in streak_data]
-        print(f"The longest streak you have achieved was {all_lengths[index]} times in a row in "
-              f"{all_habits[index]} on {all_dates[index]}.")
-    else:
-        # Visualizing streak history for a specific habit with a bar chart
-        plt.bar(all_dates, all_lengths)
-        plt.title(name)
-        plt.xlabel('Achievement Dates')
-        plt.ylabel('Achieved Streaks')
-        plt.xticks(rotation=45)
-
-        print(f"The longest streak you have achieved in {name} was {all_lengths[index]} times in a row "
-              f"on {all_dates[index]}."
-              f"\n\nYour streak history is as follows:\n")
-        plt.show()
+        longest = get_longest_streak(db)
+        # Check if there is any streak data available
+        if longest is None:
+            print("No streak data found.")
+            return  # Early return if no data is found
+        habit, length, streak_date = longest
+        print(f"The longest streak you have achieved was {length} times in a row in "
+              f"{habit} on {streak_date}.")
+        return
+
+    stats = get_habit_stats(db, name)
+    if stats is None or stats[5] is None:
+        print("No streak data found.")
+        return
+    print(f"The longest streak you have achieved in {name} was {stats[4]} times in a row "
+          f"on {stats[5]}."
+          f"\n\nYour streak history is as follows:\n")
+    if not chart:
+        # the history is streamed page by page, so long histories do not have to fit in memory
+        for streak_date, _, length in iter_streaks(db, name):
+            print(f"{streak_date}: {length} times in a row")
+        return
+
+    # Extracting all dates and streak lengths into lists for the chart
+    all_dates, all_lengths = [], []
+    for streak_date, _, length in iter_streaks(db, name):
+        all_dates.append(streak_date)
+        all_lengths.append(length)
+
+    # matplotlib is slow to import, so it is only loaded when a chart is actually shown
+    import matplotlib.pyplot as plt
+    from report import draw_streak_chart
+
+    # Visualizing streak history for a specific habit with a bar chart, drawn like the headless reports
+    draw_streak_chart(plt.figure(), name, all_dates, all_lengths)
+    plt.show()
 
 
 def print_all_counter_data(db, period):
@@ -64,6 +73,7 @@ def print_all_counter_data(db, period):
         print(f"No {period} habits found.")
 
 
+@instrument("reset_decision")
 def reset_decision(db, name, event_date_str):
     """
     Determines whether a reset is necessary based on the last check-off date and the period of the habit.
@@ -77,24 +87,15 @@ def reset_decision(db, name, event_date_str):
     last_date_str, period = get_habit_info(db, name)
 
     if last_date_str is None:
-        print("reset decision is None")
         return False  # No previous date means no need for a reset
 
-    last_date = date.fromisoformat(last_date_str)
-    event_date = date.fromisoformat(event_date_str)  # Ensure event_date_str is a date object for comparison
-    allowed_difference = timedelta(days=1 if period == 'Daily' else 7)
-
-    # Return True if the time difference is greater than the allowed difference
-    difference = event_date - last_date
-    print(f"Event Date: {event_date}")
-    if difference > allowed_difference:
-        print(f"reset decision is true, difference: {difference}")
-        return True
-    else:
-        print(f"reset decision is false, difference: {difference}")
-        return False
+    difference = days_between(last_date_str, event_date_str)
+    # reset is True if the time difference is greater than the allowed difference
+    allowed, reset = decide(difference, period)
+    return allowed and reset
 
 
+@instrument("checkoff_decision")
 def checkoff_decision(db, name, event_date_str=None):
     """
     Determines whether a check-off is allowed based on the last check-off date and the period of the habit.
@@ -110,19 +111,9 @@ def checkoff_decision(db, name, event_date_str=None):
         event_date_str = str(date.today())  # Default to today's date if not provided
 
     if last_date_str is None:
-        print("checkoff decision is True (no previous date)")
         return True  # If no previous check-off date, allow check-off
 
-    last_date = date.fromisoformat(last_date_str)
-    event_date = date.fromisoformat(event_date_str)  # Ensure event_date_str is a date object for comparison
-    allowed_difference = timedelta(days=1 if period == 'Daily' else 7)
-
     # Check if the time difference is at least the allowed difference
-    difference = event_date - last_date
-    print(f"Event Date: {event_date}")
-    if difference >= allowed_difference:
-        print(f"checkoff decision is true, difference: {difference}")
-        return True
-    else:
-        print(f"checkoff decision is false, difference: {difference}")
-        return False
+    difference = days_between(last_date_str, event_date_str)
+    allowed, _ = decide(difference, period)
+    return allowed
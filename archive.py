@@ -0,0 +1,57 @@
+from cache import invalidate
+from checkoff import to_day
+from db import retry_on_busy, encode_days
+from metrics import instrument
+
+
+@instrument("archive_history")
+@retry_on_busy
+def archive_history(db, before, names=None):
+    """
+    Moves the check-offs older than a cutoff date from the tracker table into the archive table, as one compressed
+    blob of day ordinals per habit. The streaks, current counts and statistics are maintained incrementally and do
+    not change; get_last_check, iter_checkoffs, recompute, the rollups and the histories read the archive as well.
+
+    :param db: An initialized sqlite3 database connection.
+    :param before: The cutoff date as "YYYY-MM-DD"; check-offs before this day are archived.
+    :param names: Optional. The habits to archive, all habits by default.
+    :return: The number of archived check-offs.
+    """
+    cutoff = to_day(before)
+    archived = 0
+    with db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        if names is None:
+            cur.execute("SELECT DISTINCT counterName FROM tracker WHERE date < ?", (cutoff,))
+            names = [row[0] for row in cur.fetchall()]
+        for name in names:
+            cur.execute("SELECT date FROM tracker WHERE counterName = ? AND date < ? ORDER BY date", (name, cutoff))
+            days = [row[0] for row in cur.fetchall()]
+            if not days:
+                continue
+            cur.execute("INSERT INTO archive (name, first_date, last_date, count, days) VALUES (?, ?, ?, ?, ?)",
+                        (name, days[0], days[-1], len(days), encode_days(days)))
+            cur.execute("DELETE FROM tracker WHERE counterName = ? AND date < ?", (name, cutoff))
+            archived += len(days)
+    invalidate(db)
+    return archived
+
+
+def compact(db, pages=None):
+    """
+    Returns the free pages of the database file to the file system, e.g. after archive_history. Databases created
+    before incremental vacuum was enabled are converted with one full VACUUM; after that only free pages are released.
+
+    :param db: An initialized sqlite3 database connection.
+    :param pages: Optional. The maximum number of pages to release, all free pages by default.
+    :return: The number of pages that were released.
+    """
+    free = db.execute("PRAGMA freelist_count").fetchone()[0]
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 is INCREMENTAL
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+    else:
+        # the pragma frees one page per step and execute() only steps once, executescript runs it to completion
+        db.executescript("PRAGMA incremental_vacuum" + ("" if pages is None else f"({int(pages)})"))
+    return free - db.execute("PRAGMA freelist_count").fetchone()[0]
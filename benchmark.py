@@ -0,0 +1,166 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from db import increment_counter, get_habit_info, get_last_check, delete_habit
+from workload import build_database
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def habits_for_size(events, years, probability):
+    """
+    Estimates how many habits are needed for a database with a given number of check-offs, with daily and weekly
+    habits alternating.
+
+    :param events: The wanted number of check-offs in the tracker table.
+    :param years: The number of years of history per habit.
+    :param probability: The chance that a habit is checked off on a given day.
+    :return: The number of habits.
+    """
+    daily = 365 * years * probability
+    weekly = 365 * years / (6 + 1 / probability)  # a weekly check-off waits 7 days plus the expected gap
+    return max(1, math.ceil(events / ((daily + weekly) / 2)))
+
+
+def measure(function, repeat):
+    """
+    Calls a function a number of times and summarizes the durations.
+
+    :param function: A function taking the index of the run.
+    :param repeat: The number of runs.
+    :return: A dict with the number of runs and the mean, median and min duration in milliseconds.
+    """
+    durations = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        function(run)
+        durations.append((time.perf_counter() - start) * 1000)
+    return {"runs": repeat, "mean_ms": statistics.mean(durations), "median_ms": statistics.median(durations),
+            "min_ms": min(durations)}
+
+
+def cli_startup(repeat):
+    """
+    Measures the start of a new interpreter running main.py up to the parsed command line.
+    """
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    return measure(lambda run: subprocess.run([sys.executable, main, "--help"], check=True, capture_output=True),
+                   repeat)
+
+
+def benchmark_database(events, years=3, probability=0.7, seed=0, repeat=50, directory=None):
+    """
+    Builds a synthetic database of a given size and times the hot paths on it.
+
+    :param events: The wanted number of check-offs in the tracker table.
+    :param years: The number of years of history per habit.
+    :param probability: The chance that a habit is checked off on a given day.
+    :param seed: Seed of the workload generator.
+    :param repeat: The number of runs per operation.
+    :param directory: The directory for the database file, a temporary one if not provided.
+    :return: A dict with the workload description and the timings per operation.
+    """
+    from analyse import streak_analysis
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        db, habits, accepted = build_database(os.path.join(tmp, "benchmark.db"),
+                                              habits_for_size(events, years, probability), years, probability, seed)
+        names = [habits[run % len(habits)].name for run in range(repeat)]
+        next_day = date.fromisoformat("2020-01-01") + timedelta(days=years * 365)
+        cache = db.cache
+        results = {}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["increment_counter"] = measure(
+                lambda run: increment_counter(db, names[run], str(next_day + timedelta(days=run))), repeat)
+            db.cache = None  # measure the database round trip, not the cache
+            results["get_habit_info"] = measure(lambda run: get_habit_info(db, names[run]), repeat)
+            db.cache = cache
+            results["get_habit_info_cached"] = measure(lambda run: get_habit_info(db, names[0]), repeat)
+            results["get_last_check"] = measure(lambda run: get_last_check(db, names[run]), repeat)
+            results["streak_analysis_overall"] = measure(lambda run: streak_analysis(db, "Overall"), repeat)
+            results["delete_habit"] = measure(lambda run: delete_habit(db, habits[run].name), min(repeat, len(habits)))
+        db.close()
+
+    return {"workload": {"events": accepted, "habits": len(habits), "years": years, "probability": probability,
+                         "seed": seed}, "operations": results}
+
+
+def run_benchmark(sizes=None, repeat=50, seed=0, directory=None):
+    """
+    Runs the benchmark suite for every database size and the CLI startup.
+
+    :param sizes: The database sizes in check-offs, defaults to 10k, 100k and 1M.
+    :param repeat: The number of runs per operation.
+    :param seed: Seed of the workload generator.
+    :param directory: The directory for the database files, a temporary one if not provided.
+    :return: A JSON-serializable dict with the environment and all timings.
+    """
+    sizes = sizes or DEFAULT_SIZES
+    return {
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "cli_startup": cli_startup(min(repeat, 10)),
+        "sizes": {str(size): benchmark_database(size, seed=seed, repeat=repeat, directory=directory)
+                  for size in sizes},
+    }
+
+
+def find_regressions(results, baseline, tolerance=1.5):
+    """
+    Compares benchmark results with the results of an earlier release.
+
+    :param results: The current results as returned by run_benchmark.
+    :param baseline: Earlier results in the same format.
+    :param tolerance: The factor by which a median may grow before it counts as a regression.
+    :return: A list of (operation, baseline median, current median) tuples for every regression.
+    """
+    def medians(data):
+        found = {"cli_startup": data["cli_startup"]["median_ms"]}
+        for size, result in data["sizes"].items():
+            for operation, timing in result["operations"].items():
+                found[f"{size}/{operation}"] = timing["median_ms"]
+        return found
+
+    current, previous = medians(results), medians(baseline)
+    return [(operation, previous[operation], median) for operation, median in current.items()
+            if operation in previous and median > previous[operation] * tolerance]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the habit tracker on synthetic databases.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="database sizes in check-offs")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per operation")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the workload generator")
+    parser.add_argument("--output", default="benchmark.json", help="file the JSON results are written to")
+    parser.add_argument("--baseline", help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.sizes, args.repeat, args.seed)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for operation, previous, current in regressions:
+            print(f"Regression in {operation}: {previous:.3f} ms -> {current:.3f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
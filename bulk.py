@@ -0,0 +1,102 @@
+import csv
+import json
+from datetime import date
+from checkoff import decide, schedule
+from cache import invalidate
+from metrics import instrument
+from db import retry_on_busy, next_change
+
+
+def read_events(path):
+    """
+    Reads check-off events from a CSV file (with a "name,date" header) or a JSONL file (one
+    {"name": ..., "date": ...} object per line).
+
+    :param path: Path of the file to read. Files ending in .jsonl or .json are read as JSONL, everything else as CSV.
+    :return: A generator of (name, date) tuples with dates as "YYYY-MM-DD" strings.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if str(path).endswith((".jsonl", ".json")):
+            for line in file:
+                if line.strip():
+                    event = json.loads(line)
+                    yield event["name"], event["date"]
+        else:
+            for row in csv.DictReader(file):
+                yield row["name"], row["date"]
+
+
+@instrument("bulk_add_events")
+def bulk_add_events(db, events):
+    """
+    Imports many check-off events at once. Events are grouped and sorted per habit, the check-off/reset rules are
+    replayed in memory on top of each habit's stored state, and the tracker rows, streak rows, final counts and
+    habit statistics are written with executemany in a single transaction.
+
+    Events for habits that do not exist, and events that would not be allowed as a check-off (duplicates, events
+    before the last stored check-off or inside the habit's period), are rejected.
+
+    :param db: An initialized sqlite3 database connection.
+    :param events: An iterable of (name, date) tuples with dates as "YYYY-MM-DD" strings.
+    :return: A tuple (accepted, rejected) with the number of imported and skipped events.
+    """
+    # the events are grouped before the write, so a retry after a busy database sees all of them again even when
+    # they come from a generator like read_events
+    per_habit = {}
+    for name, event_date in events:
+        per_habit.setdefault(name, []).append(event_date)
+    return _import_grouped(db, per_habit)
+
+
+@retry_on_busy
+def _import_grouped(db, per_habit):
+    tracker_rows, streak_rows, counts, stats = [], [], [], []
+    accepted = rejected = 0
+    with db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        change = next_change(cur)
+        for name, event_dates in per_habit.items():
+            cur.execute("""SELECT c.period, c.current_count, s.last_date, s.first_date, s.longest_streak,
+                           s.longest_streak_date FROM counter c JOIN habit_stats s ON s.name = c.name
+                           WHERE c.name = ?""", (name,))
+            state = cur.fetchone()
+            if state is None:
+                rejected += len(event_dates)
+                continue
+            period, count, last_day, first_day, longest, longest_day = state
+            habit_accepted = 0
+
+            # dates are parsed once into the day ordinals the database stores
+            for day in sorted(date.fromisoformat(event_date).toordinal() for event_date in event_dates):
+                allowed, reset = decide(None if last_day is None else day - last_day, period)
+                if not allowed:
+                    rejected += 1
+                    continue
+                if reset:
+                    streak_rows.append((day, name, count))
+                    if longest_day is None or count > longest:
+                        longest, longest_day = count, day
+                    count = 1
+                else:
+                    count += 1
+                tracker_rows.append((day, name))
+                if first_day is None:
+                    first_day = day
+                last_day = day
+                habit_accepted += 1
+            accepted += habit_accepted
+            counts.append((count, name))
+            # the schedule only moves if events were accepted
+            stats.append((last_day, first_day, count, habit_accepted, longest, longest_day) + schedule(last_day, period)
+                         + (change if habit_accepted else None, name))
+
+        cur.executemany("INSERT INTO tracker (date, counterName) VALUES (?, ?)", tracker_rows)
+        cur.executemany("INSERT INTO streaks (date, counterName, length) VALUES (?, ?, ?)", streak_rows)
+        cur.executemany("UPDATE counter SET current_count = ? WHERE name = ?", counts)
+        cur.executemany("""UPDATE habit_stats SET last_date = ?, first_date = ?, current_count = ?,
+                           total_checkoffs = total_checkoffs + ?, longest_streak = ?, longest_streak_date = ?,
+                           next_due = ?, breaks_at = ?, changed = COALESCE(?, changed) WHERE name = ?""", stats)
+    invalidate(db)
+
+    return accepted, rejected
@@ -0,0 +1,162 @@
+import os
+from collections import OrderedDict
+from functools import wraps
+from inspect import signature
+from threading import Lock
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        """
+        Initializes a bounded, thread-safe least-recently-used cache with hit/miss statistics.
+
+        :param maxsize: The maximum number of entries kept before the least recently used one is evicted.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # bumped on every invalidation, so reads that started before a write cannot store stale results
+        self.generation = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        :param key: The cache key.
+        :return: The cached value, or MISSING if the key is not cached.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value, generation):
+        """
+        Stores a value unless the cache was invalidated since the value was read.
+
+        :param key: The cache key.
+        :param value: The value to store.
+        :param generation: The cache generation observed before the value was read from the database.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, *kinds, keys=()):
+        """
+        Removes all entries of the given kinds and the given exact keys.
+
+        :param kinds: Kinds of entries to drop, matched against the first element of every key.
+        :param keys: Exact keys to drop.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in [key for key in self.entries if key[0] in kinds]:
+                del self.entries[key]
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the hit/miss statistics of the cache.
+
+        :return: A dict with the number of hits, misses, cached entries and the maximum size.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+
+# one cache per database file, shared by every connection to it that was opened with db.get_db
+_caches = {}
+_caches_lock = Lock()
+
+
+def cache_for(name, maxsize=1024):
+    """
+    Returns the cache shared by all connections to a database file.
+
+    :param name: The database file name as passed to sqlite3.connect.
+    :param maxsize: The size of the cache if it has to be created.
+    :return: An LRUCache instance. In-memory databases get a private cache.
+    """
+    if name in (":memory:", ""):
+        return LRUCache(maxsize)
+    path = os.path.abspath(name)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = LRUCache(maxsize)
+        return _caches[path]
+
+
+def cached(kind, returns_list=False):
+    """
+    Decorator caching the result of a read function with the signature f(db) or f(db, key) in the cache of the
+    connection. Connections without a cache are passed through. The key may also be passed as a keyword argument.
+
+    :param kind: The kind of the cached entries, used to invalidate them.
+    :param returns_list: True if the function returns a list. It is cached as a tuple and every caller gets a fresh
+                         list, so callers can modify it without touching the cache.
+    """
+    def decorator(function):
+        parameters = signature(function)
+        positional = len(parameters.parameters) - 1
+
+        @wraps(function)
+        def wrapper(db, *args, **kwargs):
+            cache = getattr(db, "cache", None)
+            if cache is None:
+                return function(db, *args, **kwargs)
+            if kwargs or len(args) != positional:
+                # keyword and default arguments are bound to their positions, so f(db, "Read") and f(db, name="Read")
+                # share an entry
+                bound = parameters.bind(db, *args, **kwargs)
+                bound.apply_defaults()
+                key = (kind,) + tuple(bound.arguments.values())[1:]
+            else:
+                key = (kind,) + args
+            value = cache.get(key)
+            if value is MISSING:
+                generation = cache.generation
+                value = function(db, *args, **kwargs)
+                cache.set(key, tuple(value) if returns_list else value, generation)
+                return value
+            return list(value) if returns_list else value
+        return wrapper
+    return decorator
+
+
+def invalidate(db, name=None, names=False):
+    """
+    Drops the cached reads affected by a write. Must be called after every write that was committed.
+
+    :param db: The database connection that was written to.
+    :param name: The habit that was changed, or None to drop the whole cache (e.g. after bulk writes).
+    :param names: True if habits were added or removed, so the list of habit names changed as well.
+    """
+    cache = getattr(db, "cache", None)
+    if cache is None:
+        return
+    if name is None:
+        cache.clear()
+        return
+    kinds = ("period", "longest") + (("names",) if names else ())
+    cache.discard(*kinds, keys=[("habit", name), ("stats", name), ("rollup", name)])
@@ -0,0 +1,79 @@
+from datetime import date
+
+
+# pure check-off rules shared by the single event path and the bulk paths
+def allowed_days(period):
+    """
+    Returns the minimum number of days between two check-offs of a habit.
+
+    :param period: The period of the habit ('Daily' or 'Weekly').
+    :return: 1 for daily habits, 7 for every other period.
+    """
+    return 1 if period == 'Daily' else 7
+
+
+def decide(days_since_last, period):
+    """
+    Decides in memory whether a check-off is allowed and whether it breaks the running streak.
+
+    :param days_since_last: The number of days between the last check-off and the new event, or None if the habit has
+                            no previous check-off (or no period).
+    :param period: The period of the habit ('Daily' or 'Weekly').
+    :return: A tuple (allowed, reset). A reset is only ever requested for an allowed check-off.
+    """
+    if days_since_last is None or period is None:
+        return True, False  # If no previous check-off date, allow check-off without a reset
+
+    allowed_difference = allowed_days(period)
+    if days_since_last < allowed_difference:
+        return False, False
+    return True, days_since_last > allowed_difference
+
+
+def schedule(last_day, period):
+    """
+    Computes when a habit is due again and when its streak breaks, from its last check-off.
+
+    :param last_day: The day ordinal of the last check-off, or None.
+    :param period: The period of the habit ('Daily' or 'Weekly').
+    :return: A tuple (next_due, breaks_at) of day ordinals: the first day a check-off is allowed again and the first
+             day a check-off would start a new streak. Both are None for a habit without check-offs.
+    """
+    if last_day is None:
+        return None, None
+    next_due = last_day + allowed_days(period)
+    return next_due, next_due + 1
+
+
+def days_between(last_date_str, event_date_str):
+    """
+    Computes the number of days between two "YYYY-MM-DD" date strings.
+
+    :param last_date_str: The earlier date string, or None.
+    :param event_date_str: The later date string.
+    :return: The difference in days, or None if there is no last date.
+    """
+    if last_date_str is None:
+        return None
+    return (date.fromisoformat(event_date_str) - date.fromisoformat(last_date_str)).days
+
+
+# dates are stored as integer day ordinals (date.toordinal) and converted at the API boundary
+def to_day(date_str):
+    """
+    Converts a "YYYY-MM-DD" date string to the day ordinal stored in the database.
+
+    :param date_str: The date string, or None.
+    :return: The day ordinal, or None.
+    """
+    return None if date_str is None else date.fromisoformat(date_str).toordinal()
+
+
+def from_day(day):
+    """
+    Converts a stored day ordinal back to a "YYYY-MM-DD" date string.
+
+    :param day: The day ordinal, or None.
+    :return: The date string, or None.
+    """
+    return None if day is None else date.fromordinal(day).isoformat()
@@ -3,6 +3,8 @@ from db import add_counter, increment_counter
 
 # Creation of main counter Class
 class HabitCounter:
+    __slots__ = ("name", "description", "period")
+
     def __init__(self, name: str, description: str, period: str):
         """
         Initializes a new HabitCounter instance to manage and track habit occurrences.
@@ -1,15 +1,128 @@
 import sqlite3
+import sys
+import threading
+import time
+import zlib
+from array import array
 from datetime import date
+from functools import wraps
+from checkoff import decide, schedule, to_day, from_day
+from migrations import migrate
+from cache import cache_for, cached, invalidate
+from metrics import instrument
+
+
+class HabitDatabase(sqlite3.Connection):
+    """
+    sqlite3 connection carrying the in-process cache of habit reads for its database file.
+    """
+    cache = None
+
+
+# connection settings for concurrent use: WAL lets readers run alongside the writer, busy_timeout makes writers wait
+# for the lock instead of failing at once, and the foreign keys keep tracker/streaks rows tied to their habit
+PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",  # only takes effect for new files, see archive.archive_history
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,  # negative values are KiB
+    "foreign_keys": "ON",
+}
+
+# how often a write is retried when the database stays locked past busy_timeout, and the first back-off in seconds
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
 
 
 # database creation as a function
-def get_db(name="test.db"):  # test.db is temporary, main.db is for normal use
-    db = sqlite3.connect(name)
-    # internal creation of tables
+def get_db(name="test.db", check_same_thread=True):  # test.db is temporary, main.db is for normal use
+    db = sqlite3.connect(name, factory=HabitDatabase, check_same_thread=check_same_thread)
+    for pragma, value in PRAGMAS.items():
+        db.execute(f"PRAGMA {pragma} = {value}")
+    # internal creation of tables, then upgrade of older layouts to the current schema version
     create_table(db)
+    migrate(db)
+    # the file may have been changed by another process since the cache was filled
+    db.cache = cache_for(name)
+    db.cache.clear()
     return db
 
 
+def retry_on_busy(function):
+    """
+    Decorator retrying a write function with exponential back-off when the database is locked by another writer.
+    The failed attempt has been rolled back, so it is safe to run the whole function again.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return function(*args, **kwargs)
+            except sqlite3.OperationalError as error:
+                if "locked" not in str(error) and "busy" not in str(error) or attempt == BUSY_RETRIES - 1:
+                    raise
+                time.sleep(BUSY_BACKOFF * 2 ** attempt)
+    return wrapper
+
+
+class ConnectionPool:
+    def __init__(self, name="test.db"):
+        """
+        Hands out one connection per thread for a database file, so the functions of this module can be used from a
+        thread pool. Connections of threads that have finished are reused by new threads.
+
+        :param name: The database file name.
+        """
+        self.name = name
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.in_use = {}  # connection -> thread using it
+        self.idle = []
+
+    def connection(self):
+        """
+        Returns the connection of the calling thread, opening or reusing one if the thread has none yet.
+
+        :return: An initialized database connection that must only be used by the calling thread.
+        """
+        db = getattr(self.local, "db", None)
+        if db is None:
+            with self.lock:
+                for pooled, thread in list(self.in_use.items()):
+                    if not thread.is_alive():
+                        del self.in_use[pooled]
+                        pooled.rollback()
+                        self.idle.append(pooled)
+                db = self.idle.pop() if self.idle else get_db(self.name, check_same_thread=False)
+                self.in_use[db] = threading.current_thread()
+            self.local.db = db
+        return db
+
+    def release(self):
+        """
+        Gives the connection of the calling thread back to the pool.
+        """
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            self.local.db = None
+            with self.lock:
+                del self.in_use[db]
+                db.rollback()
+                self.idle.append(db)
+
+    def close(self):
+        """
+        Closes all connections of the pool.
+        """
+        with self.lock:
+            for db in list(self.in_use) + self.idle:
+                db.close()
+            self.in_use.clear()
+            self.idle.clear()
+        self.local = threading.local()
+
+
 # defining of tables after creating the database
 def create_table(db):  # db parameter (return value of function get_db) is connected against the database
     # cursor is created from the database
@@ -24,13 +137,14 @@ def create_table(db):  # db parameter (return value of function get_db) is conne
 
         # creation of tracker table for storing the increments
         # tracker is connected to counter via foreign key (counterName) to the counter table
+        # dates are stored as integer day ordinals, see checkoff.to_day
         cur.execute("""CREATE TABLE IF NOT EXISTS tracker (
-            date TEXT,
+            date INTEGER,
             counterName TEXT, 
             FOREIGN KEY(counterName) REFERENCES counter(name))""")
 
         cur.execute("""CREATE TABLE IF NOT EXISTS streaks (
-                    date TEXT,
+                    date INTEGER,
                     counterName TEXT,
                     length INT,
                     FOREIGN KEY(counterName) REFERENCES counter(name))""")
@@ -42,13 +156,19 @@ def create_table(db):  # db parameter (return value of function get_db) is conne
 
 
 # the next 3 functions are for database storage/manipulation
+@instrument("add_counter")
+@retry_on_busy
 def add_counter(db, name, description, period):
     with db:
         cur = db.cursor()
         cur.execute("INSERT INTO counter (name, description, period) VALUES (?, ?, ?)", (name, description, period))
+        cur.execute("INSERT INTO habit_stats (name) VALUES (?)", (name,))
     db.commit()
+    invalidate(db, name, names=True)
 
 
+@instrument("add_streak")
+@retry_on_busy
 def add_streak(db, name, event_date):
     """
     Adds a new streak entry to the streaks table in the database and resets the current count.
@@ -63,70 +183,244 @@ def add_streak(db, name, event_date):
 
     with db:
         cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")  # take the write lock before reading the count
         cur.execute("SELECT current_count FROM counter WHERE name = ?", (name,))
         length = cur.fetchone()[0]
 
         # Inserting the new streak entry into the database
-        cur.execute("INSERT INTO streaks (date, counterName, length) VALUES (?, ?, ?)", (event_date, name, length))
+        record_streak(cur, name, to_day(event_date), length)
 
-        # Resetting the current count in the counter table
+        # Resetting the current count in the counter table and its statistics
         cur.execute("UPDATE counter SET current_count = 1 WHERE name = ?", (name,))
+        cur.execute("UPDATE habit_stats SET current_count = 1 WHERE name = ?", (name,))
         db.commit()
-        print(f"Streak for '{name}' has been recorded and counter has been resetted to 1.")
+    invalidate(db, name)
+
+
+def record_streak(cur, name, day, length):
+    """
+    Inserts a streak row and keeps the habit's longest streak in the habit_stats table up to date, without committing.
+
+    :param cur: A cursor of an open database connection.
+    :param name: The name of the habit associated with the streak.
+    :param day: The day ordinal when the streak was recorded.
+    :param length: The length of the streak.
+    """
+    cur.execute("INSERT INTO streaks (date, counterName, length) VALUES (?, ?, ?)", (day, name, length))
+    # the first streak of a given length stays the longest one, like max() over the streak history
+    cur.execute("""UPDATE habit_stats SET longest_streak = ?, longest_streak_date = ?
+                   WHERE name = ? AND (longest_streak_date IS NULL OR longest_streak < ?)""",
+                (length, day, name, length))
+
+
+def encode_days(days):
+    """
+    Packs sorted day ordinals into a compressed blob: the first day followed by the gaps between the days, as
+    little-endian 32 bit integers, compressed with zlib. Gaps of check-off histories are small, so they compress well.
+
+    :param days: A sorted list of day ordinals.
+    :return: The blob as bytes.
+    """
+    deltas = array("i", [days[0]] + [day - previous for previous, day in zip(days, days[1:])])
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
 
 
+def decode_days(blob):
+    """
+    Unpacks a blob written by encode_days.
+
+    :param blob: The blob as bytes.
+    :return: The sorted list of day ordinals.
+    """
+    deltas = array("i")
+    deltas.frombytes(zlib.decompress(blob))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    days, day = [], 0
+    for delta in deltas:
+        day += delta
+        days.append(day)
+    return days
+
+
+def iter_archived_days(cur, name, low=None, high=None):
+    """
+    Streams the archived check-off days of a habit in date order, decoding one archive blob at a time.
+
+    :param cur: A cursor of an open database connection. The blobs are read with a separate cursor of the same
+                connection, so the caller can keep using this one while the generator runs.
+    :param name: The name of the habit.
+    :param low: Optional. The first day ordinal to include.
+    :param high: Optional. The last day ordinal to include.
+    :return: A generator of day ordinals.
+    """
+    blobs = cur.connection.cursor()
+    blobs.execute("""SELECT days FROM archive WHERE name = ? AND last_date >= ? AND first_date <= ?
+                     ORDER BY first_date""", (name, -1 if low is None else low, sys.maxsize if high is None else high))
+    for (blob,) in blobs:
+        for day in decode_days(blob):
+            if (low is None or day >= low) and (high is None or day <= high):
+                yield day
+
+
+@instrument("increment_counter")
+@retry_on_busy
 def increment_counter(db, name, event_date=None):
     """
     Inserts a check-off event for a habit into the tracker table and updates the habit's count in the database.
     It checks if the habit is allowed to be checked off based on its period and the last check-off date.
-    If a reset is necessary (determined by the reset_decision function), a new streak is added and the count is reset.
+    If a reset is necessary (see checkoff.decide), a new streak is added and the count is reset.
     Otherwise, the current count is incremented.
 
+    The period, last date and count are read in a single query from the counter and habit_stats tables and all
+    writes happen in one transaction.
+
     :param db: An initialized SQLite3 database connection. It provides the methods to interact with the database.
     :param name: The name of the habit to check off. This is used to identify the habit in the database.
     :param event_date: Optional. The date of the event. Defaults to today's date if not provided. This is used to
                        record when the habit was checked off.
-    :return: True if the check-off event was successfully added and False if not allowed.
+    :return: True if the check-off event was successfully added and False if not allowed or the habit does not exist.
              It also commits the transaction to the database after modifying the data.
     """
-    from analyse import checkoff_decision, reset_decision
-
     if not event_date:
         event_date = str(date.today())
 
-    if not checkoff_decision(db, name, event_date):
-        print(f"The habit '{name}' cannot be checked off today ({event_date}).")
-        return False
-
     with db:
         cur = db.cursor()
-        if reset_decision(db, name, event_date):
-            add_streak(db, name, event_date)
-        else:
-            cur.execute("UPDATE counter SET current_count = current_count + 1 WHERE name = ?", (name,))
-        cur.execute("INSERT INTO tracker (date, counterName) VALUES (?, ?)", (event_date, name))
-        print(f"Habit '{name}' successfully checked off for today ({event_date}).")
+        # take the write lock before reading the state, so concurrent check-offs cannot both pass the decision
+        cur.execute("BEGIN IMMEDIATE")
+        if not apply_checkoff(cur, name, event_date):
+            return False
+    invalidate(db, name)
+    return True
 
-        db.commit()
 
+def next_change(cur):
+    """
+    Returns the change number to store in habit_stats.changed for habits whose next_due and breaks_at are moved by
+    the current write transaction, see scheduler.DueScheduler.
+
+    :param cur: A cursor of an open write transaction.
+    :return: A number larger than every change number stored so far.
+    """
+    cur.execute("SELECT COALESCE(MAX(changed), 0) + 1 FROM habit_stats")
+    return cur.fetchone()[0]
+
+
+def apply_checkoff(cur, name, event_date):
+    """
+    Applies one check-off with the given cursor without committing, so callers control the transaction.
+
+    :param cur: A cursor of an open database connection.
+    :param name: The name of the habit to check off.
+    :param event_date: The date of the event as a "YYYY-MM-DD" string.
+    :return: True if the check-off was written, False if it is not allowed or the habit does not exist.
+    """
+    cur.execute("""SELECT c.period, c.current_count, s.last_date FROM counter c
+                   JOIN habit_stats s ON s.name = c.name WHERE c.name = ?""", (name,))
+    state = cur.fetchone()
+    if state is None:
+        return False
+    period, current_count, last_day = state
+
+    day = to_day(event_date)
+    allowed, reset = decide(None if last_day is None else day - last_day, period)
+    if not allowed:
+        return False
+
+    if reset:
+        record_streak(cur, name, day, current_count)
+        current_count = 1
+    else:
+        current_count += 1
+    cur.execute("UPDATE counter SET current_count = ? WHERE name = ?", (current_count, name))
+    next_due, breaks_at = schedule(day, period)
+    cur.execute("""UPDATE habit_stats SET last_date = ?, first_date = COALESCE(first_date, ?), current_count = ?,
+                   total_checkoffs = total_checkoffs + 1, next_due = ?, breaks_at = ?, changed = ? WHERE name = ?""",
+                (day, day, current_count, next_due, breaks_at, next_change(cur), name))
+    cur.execute("INSERT INTO tracker (date, counterName) VALUES (?, ?)", (day, name))
     return True
 
 
+@instrument("get_last_check")
 def get_last_check(db, name):
     """
     Retrieves all check-off events for a specific habit from the 'tracker' table.
 
     :param db: The database connection object. This is used to execute SQL commands.
     :param name: The name of the habit whose check-off events are to be retrieved.
-    :return: A list of tuples where each tuple represents a check-off event associated with the habit.
+    :return: A list of tuples where each tuple represents a check-off event associated with the habit, including
+             the archived ones.
     """
     with db:
         cur = db.cursor()
+        checklist = [(from_day(day), name) for day in iter_archived_days(cur, name)]
         cur.execute("SELECT * FROM tracker WHERE counterName = ?", (name,))
-        checklist = cur.fetchall()
+        checklist += [(from_day(day), counter_name) for day, counter_name in cur.fetchall()]
         return checklist
 
 
+def iter_checkoffs(db, name, after=None, start=None, end=None, limit=None, page_size=500):
+    """
+    Streams the check-off events of a habit in date order, fetching one page at a time, so memory use does not grow
+    with the length of the history. Archived check-offs come first, one archive blob at a time; live pages are read
+    with keyset pagination on (date, rowid) over the tracker(counterName, date) index.
+
+    :param db: The database connection object.
+    :param name: The name of the habit whose check-off events are to be retrieved.
+    :param after: Optional. Only events after this "YYYY-MM-DD" date are returned, e.g. to continue a listing.
+    :param start: Optional. The first date to include.
+    :param end: Optional. The last date to include.
+    :param limit: Optional. The maximum number of events to return.
+    :param page_size: The number of rows fetched per query.
+    :return: A generator of (date, counterName) tuples like the rows returned by get_last_check.
+    """
+    conditions, parameters = ["counterName = ?"], [name]
+    if after is not None:
+        conditions.append("date > ?")
+        parameters.append(to_day(after))
+    if start is not None:
+        conditions.append("date >= ?")
+        parameters.append(to_day(start))
+    if end is not None:
+        conditions.append("date <= ?")
+        parameters.append(to_day(end))
+    query = f"SELECT date, counterName, rowid FROM tracker WHERE {' AND '.join(conditions)}"
+
+    # archived check-offs are all older than the live ones
+    low = None if after is None else to_day(after) + 1
+    if start is not None:
+        low = to_day(start) if low is None else max(low, to_day(start))
+    for day in iter_archived_days(db.cursor(), name, low, None if end is None else to_day(end)):
+        if limit is not None:
+            if limit == 0:
+                return
+            limit -= 1
+        yield from_day(day), name
+
+    position = None
+    while limit is None or limit > 0:
+        size = page_size if limit is None else min(page_size, limit)
+        cur = db.cursor()
+        if position is None:
+            cur.execute(f"{query} ORDER BY date, rowid LIMIT ?", parameters + [size])
+        else:
+            cur.execute(f"{query} AND (date, rowid) > (?, ?) ORDER BY date, rowid LIMIT ?",
+                        parameters + list(position) + [size])
+        page = cur.fetchall()
+        for day, counter_name, _ in page:
+            yield from_day(day), counter_name
+        if len(page) < size:
+            return
+        position = (page[-1][0], page[-1][2])
+        if limit is not None:
+            limit -= len(page)
+
+
+@instrument("get_habit_info")
+@cached("habit")
 def get_habit_info(db, name):
     """
     Retrieves the last check-off date and the period of a specific habit.
@@ -137,22 +431,19 @@ def get_habit_info(db, name):
     """
     with db:
         cur = db.cursor()
-        cur.execute("SELECT MAX(date) FROM tracker WHERE counterName = ?", (name,))
-        last_date = cur.fetchone()[0]
-
-        cur.execute("SELECT period FROM counter WHERE name = ?", (name,))
+        cur.execute("""SELECT s.last_date, c.period FROM counter c
+                       JOIN habit_stats s ON s.name = c.name WHERE c.name = ?""", (name,))
         result = cur.fetchone()
-        period = result[0] if result else None
+        last_date, period = (from_day(result[0]), result[1]) if result else (None, None)
 
         if last_date is None or period is None:
-            print(f"get_habit_info last date none")  # Debug Output
             return None, None
 
-    print(f"get_habit_info last date exists")  # debug output
-    print(f"Last Check-off Date: {last_date}")
     return last_date, period
 
 
+@instrument("get_all_counter_data")
+@cached("period", returns_list=True)
 def get_all_counter_data(db, period):
     """
     Retrieves all habit entries from the 'counter' table in the database that match the specified period.
@@ -172,6 +463,7 @@ def get_all_counter_data(db, period):
         return counter_list
 
 
+@instrument("get_streak_data")
 def get_streak_data(db, name):
     """
     Retrieves streak data for a specific habit or all habits from the 'streaks' table.
@@ -186,9 +478,107 @@ def get_streak_data(db, name):
             cur.execute("SELECT * FROM streaks")
         else:
             cur.execute("SELECT * FROM streaks WHERE counterName=?", (name,))
-        return cur.fetchall()
+        return [(from_day(day), counter_name, length) for day, counter_name, length in cur.fetchall()]
+
+
+def iter_streaks(db, name, page_size=500):
+    """
+    Streams streak data for a specific habit or all habits, fetching one page at a time. The streaks of all habits
+    come in the order they were recorded, with keyset pagination on the rowid; the streaks of one habit come in date
+    order, with keyset pagination on (date, rowid) over the streaks(counterName, date) index, so every page is an
+    index range search without sorting.
+
+    :param db: an initialized sqlite3 database connection.
+    :param name: the name of the habit to retrieve streak data for, or "Overall" to retrieve data for all habits.
+    :param page_size: the number of rows fetched per query.
+    :return: a generator of (date, counterName, length) tuples.
+    """
+    position = None
+    while True:
+        cur = db.cursor()
+        if name == "Overall":
+            cur.execute("SELECT date, counterName, length, rowid FROM streaks WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (0 if position is None else position[1], page_size))
+        elif position is None:
+            cur.execute("""SELECT date, counterName, length, rowid FROM streaks WHERE counterName = ?
+                           ORDER BY date, rowid LIMIT ?""", (name, page_size))
+        else:
+            cur.execute("""SELECT date, counterName, length, rowid FROM streaks WHERE counterName = ?
+                           AND (date, rowid) > (?, ?) ORDER BY date, rowid LIMIT ?""", (name, *position, page_size))
+        page = cur.fetchall()
+        for day, counter_name, length, _ in page:
+            yield from_day(day), counter_name, length
+        if len(page) < page_size:
+            return
+        position = (page[-1][0], page[-1][3])
+
+
+@instrument("get_habit_stats")
+@cached("stats")
+def get_habit_stats(db, name):
+    """
+    Retrieves the maintained statistics of a specific habit from the 'habit_stats' table.
+
+    :param db: an initialized sqlite3 database connection.
+    :param name: the name of the habit.
+    :return: a tuple (last_date, first_date, current_count, total_checkoffs, longest_streak, longest_streak_date),
+             or None if the habit does not exist.
+    """
+    with db:
+        cur = db.cursor()
+        cur.execute("""SELECT last_date, first_date, current_count, total_checkoffs, longest_streak, longest_streak_date
+                       FROM habit_stats WHERE name = ?""", (name,))
+        stats = cur.fetchone()
+        if stats is None:
+            return None
+        last_day, first_day, current_count, total_checkoffs, longest_streak, longest_streak_day = stats
+        return (from_day(last_day), from_day(first_day), current_count, total_checkoffs, longest_streak,
+                from_day(longest_streak_day))
+
+
+@instrument("get_longest_streak")
+@cached("longest")
+def get_longest_streak(db):
+    """
+    Retrieves the longest streak recorded across all habits from the 'habit_stats' table.
+
+    :param db: an initialized sqlite3 database connection.
+    :return: a tuple (name, length, date) of the longest streak, or None if no streak was recorded yet.
+    """
+    with db:
+        cur = db.cursor()
+        cur.execute("""SELECT name, longest_streak, longest_streak_date FROM habit_stats
+                       WHERE longest_streak_date IS NOT NULL
+                       ORDER BY longest_streak DESC, longest_streak_date, name LIMIT 1""")
+        longest = cur.fetchone()
+        return None if longest is None else (longest[0], longest[1], from_day(longest[2]))
+
+
+@instrument("due_habits")
+def due_habits(db, on_date=None):
+    """
+    Retrieves the habits that can be checked off on a given day, using the index on habit_stats.next_due instead of
+    deciding habit by habit.
+
+    :param db: an initialized sqlite3 database connection.
+    :param on_date: Optional. The day as "YYYY-MM-DD", defaults to today's date.
+    :return: a list of (name, next_due, breaks_at, overdue) tuples ordered by next_due, where overdue is True if the
+             streak is already broken on that day. Habits that were never checked off come first with None dates.
+    """
+    day = to_day(on_date or str(date.today()))
+    with db:
+        cur = db.cursor()
+        # two index range scans; with "next_due IS NULL OR next_due <= ?" SQLite walks the whole index
+        cur.execute("""SELECT name, next_due, breaks_at FROM habit_stats WHERE next_due IS NULL
+                       UNION ALL
+                       SELECT name, next_due, breaks_at FROM habit_stats WHERE next_due <= ?
+                       ORDER BY next_due, name""", (day,))
+        return [(name, from_day(next_due), from_day(breaks_at), breaks_at is not None and breaks_at <= day)
+                for name, next_due, breaks_at in cur.fetchall()]
 
 
+@instrument("get_all_counter_names")
+@cached("names", returns_list=True)
 def get_all_counter_names(db):
     """
     Retrieves a list of habit names from the 'counter' table in the database.
@@ -203,9 +593,11 @@ def get_all_counter_names(db):
         return [counter[0] for counter in all_counters]  # Return names extracted from tuples
 
 
+@instrument("delete_habit")
+@retry_on_busy
 def delete_habit(db, name):
     """
-    Deletes a habit and its related entries from both the counter and tracker tables based on its name.
+    Deletes a habit and its related entries from the counter, tracker, streaks and archive tables based on its name.
 
     Parameters:
     - db: The database connection object.
@@ -213,10 +605,13 @@ def delete_habit(db, name):
     """
     with db:
         cur = db.cursor()
-        # First, delete related entries from the tracker table
+        # First, delete related entries from the tracker and streaks tables
         cur.execute("DELETE FROM tracker WHERE counterName = ?", (name,))
+        cur.execute("DELETE FROM streaks WHERE counterName = ?", (name,))
+        cur.execute("DELETE FROM habit_stats WHERE name = ?", (name,))
+        cur.execute("DELETE FROM archive WHERE name = ?", (name,))
         # Then, delete the habit from the counter table
         cur.execute("DELETE FROM counter WHERE name = ?", (name,))
         # Commit the changes to the database
         db.commit()
-        print(f"Habit '{name}' and its related entries were deleted successfully.")
+    invalidate(db, name, names=True)
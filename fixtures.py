@@ -0,0 +1,54 @@
+import threading
+from db import get_db
+from workload import build_database, generate_habits
+
+# the seed of all fixture databases, so every test run sees the same check-offs
+FIXTURE_SEED = 20240310
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def template_database(habits=5, years=1, probability=0.5, seed=FIXTURE_SEED, start_date="2020-01-01"):
+    """
+    Returns an in-memory database filled with a synthetic workload, built once per process for every combination of
+    parameters. Templates must not be changed; use habit_database to get a copy.
+
+    :param habits: The number of habits, see workload.generate_habits.
+    :param years: The number of years of history.
+    :param probability: The chance that a habit is checked off on a given day.
+    :param seed: Seed of the random generator.
+    :param start_date: The first day of the history as a "YYYY-MM-DD" string.
+    :return: A tuple (db, accepted) with the template connection and the number of accepted check-offs.
+    """
+    key = (habits, years, probability, seed, start_date)
+    with _templates_lock:
+        if key not in _templates:
+            db, _, accepted = build_database(":memory:", habits, years, probability, seed, start_date)
+            _templates[key] = (db, accepted)
+        return _templates[key]
+
+
+def clone_database(template, name=":memory:"):
+    """
+    Copies a database page by page with the SQLite backup API, which is much faster than replaying its check-offs.
+
+    :param template: The database connection to copy.
+    :param name: The file name of the copy, or ":memory:".
+    :return: An initialized connection to the copy, like get_db returns.
+    """
+    db = get_db(name)
+    template.backup(db)
+    db.cache.clear()
+    return db
+
+
+def habit_database(name=":memory:", habits=5, years=1, probability=0.5, seed=FIXTURE_SEED, start_date="2020-01-01"):
+    """
+    Returns a private copy of a template database, so tests get isolated, deterministic data without building it.
+
+    :param name: The file name of the copy, or ":memory:".
+    :return: A tuple (db, habits, accepted) like workload.build_database.
+    """
+    template, accepted = template_database(habits, years, probability, seed, start_date)
+    return clone_database(template, name), generate_habits(habits), accepted
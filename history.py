@@ -0,0 +1,174 @@
+import sys
+from checkoff import allowed_days, to_day, from_day
+from db import iter_archived_days
+
+
+class HabitHistory:
+    # a habit with many check-offs stays small: no per-instance __dict__ and one integer for the whole history
+    __slots__ = ("name", "period", "first_day", "bits")
+
+    def __init__(self, name, period, days=()):
+        """
+        Compact in-memory check-off history of a habit. Bit i of `bits` is set if the habit was checked off on day
+        `first_day + i`, so streak and range questions are answered with integer bit operations.
+
+        :param name: The name of the habit.
+        :param period: The period of the habit ('Daily' or 'Weekly').
+        :param days: The day ordinals of the check-offs, in any order.
+        """
+        self.name = name
+        self.period = period
+        self.first_day = min(days) if days else None
+        self.bits = 0
+        if days:
+            # setting the bits in a byte buffer and converting once is much faster than growing an int bit by bit
+            buffer = bytearray((max(days) - self.first_day) // 8 + 1)
+            for day in days:
+                offset = day - self.first_day
+                buffer[offset >> 3] |= 1 << (offset & 7)
+            self.bits = int.from_bytes(buffer, "little")
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def _offset(self, date_str):
+        return to_day(date_str) - self.first_day
+
+    @property
+    def last_day(self):
+        return None if self.first_day is None else self.first_day + self.bits.bit_length() - 1
+
+    def add(self, date_str):
+        """
+        Adds a check-off to the history, e.g. after it was accepted by db.increment_counter.
+
+        :param date_str: The date of the check-off as "YYYY-MM-DD".
+        """
+        day = to_day(date_str)
+        if self.first_day is None:
+            self.first_day = day
+        elif day < self.first_day:
+            self.bits <<= self.first_day - day
+            self.first_day = day
+        self.bits |= 1 << (day - self.first_day)
+
+    def done_on(self, date_str):
+        """
+        Checks whether the habit was checked off on a given day.
+
+        :param date_str: The date as "YYYY-MM-DD".
+        :return: True if there is a check-off on that day.
+        """
+        if self.first_day is None:
+            return False
+        offset = self._offset(date_str)
+        return offset >= 0 and bool(self.bits >> offset & 1)
+
+    def current_streak(self, on_date=None):
+        """
+        Returns the length of the streak ending with the last check-off, like counter.current_count.
+
+        :param on_date: Optional. If given as "YYYY-MM-DD", a streak that can no longer be continued on that day
+                        (more than one period after the last check-off) counts as 0.
+        :return: The number of check-offs in a row.
+        """
+        if self.first_day is None:
+            return 0
+        step = allowed_days(self.period)
+        last = self.bits.bit_length() - 1
+        if on_date is not None and self._offset(on_date) - last > step:
+            return 0
+        # after k rounds, bit i is set if the check-offs at i, i + step, ..., i + k * step all exist
+        chains, length = self.bits, 1
+        while last - length * step >= 0:
+            chains &= chains >> step
+            if not chains >> (last - length * step) & 1:
+                break
+            length += 1
+        return length
+
+    def longest_streak(self):
+        """
+        Returns the longest streak of the whole history, including the current one.
+
+        :return: The largest number of check-offs in a row.
+        """
+        step = allowed_days(self.period)
+        chains, length = self.bits, 0
+        while chains:
+            chains &= chains >> step
+            length += 1
+        return length
+
+    def completions(self, start, end):
+        """
+        Counts the check-offs in a date range.
+
+        :param start: The first date to include, as "YYYY-MM-DD".
+        :param end: The last date to include, as "YYYY-MM-DD".
+        :return: The number of check-offs.
+        """
+        if self.first_day is None:
+            return 0
+        low, high = max(self._offset(start), 0), self._offset(end)
+        if high < low:
+            return 0
+        return (self.bits >> low & ((1 << (high - low + 1)) - 1)).bit_count()
+
+    def completion_rate(self, start, end):
+        """
+        Returns the share of periods in a date range in which the habit was checked off.
+
+        :param start: The first date to include, as "YYYY-MM-DD".
+        :param end: The last date to include, as "YYYY-MM-DD".
+        :return: The completion rate between 0 and 1 (or 0 for an empty range).
+        """
+        days = to_day(end) - to_day(start) + 1
+        if days <= 0:
+            return 0
+        periods = -(-days // allowed_days(self.period))  # ceiling division
+        return min(self.completions(start, end) / periods, 1)
+
+    def memory_bytes(self):
+        """
+        Returns the memory used by this history in bytes.
+        """
+        return sum(sys.getsizeof(value) for value in (self, self.first_day, self.bits))
+
+    def __repr__(self):
+        return f"HabitHistory({self.name!r}, {self.period!r}, {len(self)} check-offs until {from_day(self.last_day)})"
+
+
+def load_histories(db, names=None):
+    """
+    Loads the check-off histories of habits from the tracker table and the archive.
+
+    :param db: An initialized sqlite3 database connection.
+    :param names: Optional. The habits to load, all habits by default.
+    :return: A dict mapping habit names to HabitHistory instances.
+    """
+    with db:
+        cur = db.cursor()
+        cur.execute("SELECT name, period FROM counter")
+        periods = dict(cur.fetchall())
+        cur.execute("SELECT counterName, date FROM tracker ORDER BY counterName")
+        rows = cur.fetchall()
+        cur.execute("SELECT DISTINCT name FROM archive")
+        for name in [row[0] for row in cur.fetchall()]:
+            rows += [(name, day) for day in iter_archived_days(cur, name)]
+
+    days = {}
+    for name, day in rows:
+        days.setdefault(name, []).append(day)
+    wanted = periods if names is None else [name for name in names if name in periods]
+    return {name: HabitHistory(name, periods[name], days.get(name, [])) for name in wanted}
+
+
+def memory_footprint(histories):
+    """
+    Returns the memory used by a collection of histories, including the dict holding them.
+
+    :param histories: A dict as returned by load_histories.
+    :return: The size in bytes.
+    """
+    return sys.getsizeof(histories) + sum(history.memory_bytes() for history in histories.values())
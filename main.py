@@ -1,7 +1,12 @@
-import questionary
+import argparse
+import sys
+from datetime import date
 from analyse import print_all_counter_data, streak_analysis
-from db import get_db, get_all_counter_names, delete_habit, get_last_check
+from db import get_db, get_all_counter_names, delete_habit, iter_checkoffs
 from class_counter import HabitCounter
+import metrics
+# questionary, matplotlib and numpy are only imported by the code paths that need them,
+# so the non-interactive commands start quickly
 
 
 def counter_choice(db, include_all_option=False):
@@ -12,6 +17,7 @@ def counter_choice(db, include_all_option=False):
     :param include_all_option: boolean indicating whether to include the "Overall" option in the selection list
     :return: the name of the selected habit, None for going back or Overall if needed
     """
+    import questionary
 
     counter_names = get_all_counter_names(db)
     if include_all_option:
@@ -29,8 +35,26 @@ def counter_choice(db, include_all_option=False):
         return name  # Return the selected habit name or "All"
 
 
-def cli():
-    db = get_db()
+def print_checkoff_result(name, event_date, accepted):
+    """
+    Tells the user whether a check-off was accepted.
+
+    :param name: The name of the habit.
+    :param event_date: The date of the check-off as "YYYY-MM-DD", or None for today.
+    :param accepted: The result of HabitCounter.add_event.
+    """
+    event_date = event_date or str(date.today())
+    if accepted:
+        print(f"Habit '{name}' successfully checked off for today ({event_date}).")
+    else:
+        print(f"The habit '{name}' cannot be checked off today ({event_date}).")
+
+
+def cli(db=None):
+    import questionary
+
+    if db is None:
+        db = get_db()
     questionary.confirm("Are you ready to rumble?").ask()
 
     stop = False
@@ -64,6 +88,7 @@ def cli():
                                               choices=["Yes", "No"]).ask()
             if confirmation == "Yes":
                 delete_habit(db, name)
+                print(f"Habit '{name}' and its related entries were deleted successfully.")
             else:
                 continue
 
@@ -72,15 +97,19 @@ def cli():
             if name is None:
                 continue
             counter = HabitCounter(name, "", "")
-            check_off_allowed = counter.add_event(db)
-            print(f"Check-off allowed: {check_off_allowed}")  # Debugging output
+            print_checkoff_result(name, None, counter.add_event(db))
 
         elif choice == "See last check offs":
             name = counter_choice(db)
             if name is None:
                 continue
-            checklist = get_last_check(db, name)
-            print(checklist)
+            # the history is streamed page by page, so long histories do not have to fit in memory
+            found = False
+            for event_date, _ in iter_checkoffs(db, name):
+                print(f"{name} checked off on {event_date}")
+                found = True
+            if not found:
+                print(f"{name} has not been checked off yet.")
 
         elif choice == "Analyse habits":
             choice = questionary.select(
@@ -108,5 +137,136 @@ def cli():
             stop = True
 
 
+def main(argv=None):
+    """
+    Entry point of the program. Without a command the interactive menu is started, the commands run without it.
+
+    :param argv: Optional list of command line arguments, defaults to sys.argv.
+    """
+    parser = argparse.ArgumentParser(description="Track your daily and weekly habits.")
+    parser.add_argument("--db", help="database file to use instead of the default one from db.get_db")
+    parser.add_argument("--metrics", choices=["json", "prometheus"],
+                        help="print call counts, latencies and SQL statements per operation after the command")
+    parser.add_argument("--metrics-output", help="file the metrics are written to instead of the standard output")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser("import", help="bulk import check-offs from a CSV or JSONL file")
+    import_parser.add_argument("file", help="CSV file with a name,date header or JSONL file with name/date objects")
+    recompute_parser = commands.add_parser("recompute", help="rebuild streaks and current counts from the check-offs")
+    recompute_parser.add_argument("--verify", action="store_true", help="only report differences, change nothing")
+    checkoff_parser = commands.add_parser("checkoff", help="check off a habit")
+    checkoff_parser.add_argument("name", help="name of the habit")
+    checkoff_parser.add_argument("--date", help="date of the check-off as YYYY-MM-DD, defaults to today")
+    list_parser = commands.add_parser("list", help="list habits with their current count")
+    list_parser.add_argument("--period", choices=["Daily", "Weekly"], help="only list habits of this period")
+    streaks_parser = commands.add_parser("streaks", help="show the longest streak and the streak history of a habit")
+    streaks_parser.add_argument("name", help='name of the habit, or "Overall" for the longest streak of all habits')
+    streaks_parser.add_argument("--chart", action="store_true", help="also show the streak history as a bar chart")
+    report_parser = commands.add_parser("report", help="render streak and calendar charts of all habits to files")
+    report_parser.add_argument("databases", nargs="*", help="database files to report on, defaults to the one in use")
+    report_parser.add_argument("--output", default="reports", help="directory the charts are written to")
+    report_parser.add_argument("--format", nargs="+", default=["png"], choices=["png", "svg", "pdf"],
+                               help="image formats of the charts")
+    report_parser.add_argument("--workers", type=int, help="number of rendering processes, defaults to the CPUs")
+    snapshot_parser = commands.add_parser("snapshot", help="export the check-offs and streaks as NumPy files")
+    snapshot_parser.add_argument("directory", help="snapshot directory; only new rows are added to an existing one")
+    snapshot_parser.add_argument("--full", action="store_true", help="write the snapshot from scratch")
+    snapshot_parser.add_argument("--restore", action="store_true", help="import the snapshot into the database")
+    archive_parser = commands.add_parser("archive", help="move old check-offs into compressed archive blobs")
+    archive_parser.add_argument("--before", required=True, help="check-offs before this YYYY-MM-DD date are archived")
+    archive_parser.add_argument("--no-compact", action="store_true", help="keep the freed pages in the database file")
+    maintain_parser = commands.add_parser("maintain", help="run a maintenance job on many database files in parallel")
+    maintain_parser.add_argument("job", choices=["integrity", "recompute", "vacuum", "orphans"], help="job to run")
+    maintain_parser.add_argument("paths", nargs="+", help="database files, or directories searched for *.db files")
+    maintain_parser.add_argument("--workers", type=int, help="number of worker processes, defaults to the CPUs")
+    maintain_parser.add_argument("--state", help="state file; a run with the same state file skips finished files")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.reset()
+        metrics.enable()
+    try:
+        if args.command == "maintain":
+            # works on the given files only, not on the database of --db
+            from maintenance import run_maintenance
+
+            results = run_maintenance(args.paths, args.job, args.workers, args.state)
+            return 0 if all(result["status"] in ("ok", "skipped") for result in results.values()) else 1
+        db = get_db(args.db) if args.db else get_db()
+        return run_command(db, args)
+    finally:
+        if args.metrics:
+            metrics.disable()
+            output = metrics.to_json() if args.metrics == "json" else metrics.to_prometheus()
+            if args.metrics_output:
+                with open(args.metrics_output, "w") as file:
+                    file.write(output)
+            else:
+                print(output)
+
+
+def run_command(db, args):
+    """
+    Runs the command given on the command line, or the interactive menu if there is none.
+
+    :param db: An initialized sqlite3 database connection.
+    :param args: The parsed command line arguments.
+    :return: The exit code.
+    """
+    if args.command == "checkoff":
+        accepted = HabitCounter(args.name, "", "").add_event(db, args.date)
+        print_checkoff_result(args.name, args.date, accepted)
+        # a failed check-off gives a non-zero exit code for scripts
+        return 0 if accepted else 1
+    elif args.command == "list":
+        for period in [args.period] if args.period else ["Daily", "Weekly"]:
+            print_all_counter_data(db, period)
+    elif args.command == "streaks":
+        streak_analysis(db, args.name, chart=args.chart)
+    elif args.command == "import":
+        from bulk import bulk_add_events, read_events
+
+        accepted, rejected = bulk_add_events(db, read_events(args.file))
+        print(f"Imported {accepted} check-offs, skipped {rejected}.")
+    elif args.command == "report":
+        from report import render_reports
+
+        databases = args.databases or [db.execute("PRAGMA database_list").fetchone()[2]]
+        rendered, skipped = render_reports(databases, args.output, args.format, args.workers)
+        print(f"Rendered {len(rendered)} charts to {args.output}, {len(skipped)} were unchanged.")
+    elif args.command == "snapshot":
+        from snapshot import export_snapshot, import_snapshot
+
+        if args.restore:
+            print(f"Restored {import_snapshot(db, args.directory)} check-offs from {args.directory}.")
+        else:
+            written = export_snapshot(db, args.directory, append=not args.full)
+            print(f"Wrote {written['tracker']} check-offs and {written['streaks']} streaks to {args.directory}.")
+    elif args.command == "archive":
+        from archive import archive_history, compact
+
+        print(f"Archived {archive_history(db, args.before)} check-offs from before {args.before}.")
+        if not args.no_compact:
+            print(f"Released {compact(db)} free pages.")
+    elif args.command == "recompute":
+        from recompute import recompute
+
+        differences = recompute(db, verify=args.verify)
+        for name, difference in differences.items():
+            message = (f"{name}: {len(difference['missing'])} missing and {len(difference['unexpected'])} "
+                       f"unexpected streaks")
+            if difference["stored"] != difference["computed"]:
+                message += f", current count {difference['stored']} should be {difference['computed']}"
+            if not difference["stats_consistent"]:
+                message += ", statistics out of date"
+            print(message)
+        if not differences:
+            print("Streaks and current counts are consistent with the check-offs.")
+        elif not args.verify:
+            print(f"Repaired {len(differences)} habits.")
+    else:
+        cli(db)
+    return 0
+
+
 if __name__ == "__main__":
-    cli()
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import glob
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from db import get_db
+
+
+def integrity_check(db):
+    """
+    Checks the database file and the references of the check-offs and streaks to their habits.
+
+    :return: A tuple (ok, detail).
+    """
+    problems = [row[0] for row in db.execute("PRAGMA integrity_check").fetchall() if row[0] != "ok"]
+    problems += [f"{row[0]} row {row[1]} references a missing {row[2]}"
+                 for row in db.execute("PRAGMA foreign_key_check").fetchall()]
+    return not problems, "; ".join(problems[:10]) or "ok"
+
+
+def recompute_job(db):
+    """
+    Rebuilds the streaks, current counts and statistics from the check-offs, see recompute.recompute.
+
+    :return: A tuple (ok, detail).
+    """
+    from recompute import recompute
+
+    return True, f"repaired {len(recompute(db))} habits"
+
+
+def vacuum_analyze(db):
+    """
+    Rebuilds the database file without free pages and refreshes the query planner statistics.
+
+    :return: A tuple (ok, detail).
+    """
+    before = db.execute("PRAGMA page_count").fetchone()[0]
+    db.execute("VACUUM")
+    db.execute("ANALYZE")
+    return True, f"{before} -> {db.execute('PRAGMA page_count').fetchone()[0]} pages"
+
+
+def remove_orphans(db):
+    """
+    Deletes check-offs, streaks, statistics and archived check-offs of habits that no longer exist, as left behind by
+    older versions of delete_habit.
+
+    :return: A tuple (ok, detail).
+    """
+    deleted = {}
+    with db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for table, column in [("tracker", "counterName"), ("streaks", "counterName"), ("habit_stats", "name"),
+                              ("archive", "name")]:
+            cur.execute(f"DELETE FROM {table} WHERE {column} NOT IN (SELECT name FROM counter)")
+            deleted[table] = cur.rowcount
+    return True, ", ".join(f"{count} {table}" for table, count in deleted.items()) + " rows deleted"
+
+
+JOBS = {"integrity": integrity_check, "recompute": recompute_job, "vacuum": vacuum_analyze, "orphans": remove_orphans}
+
+
+def discover(paths):
+    """
+    Finds the database files to maintain.
+
+    :param paths: Database files and directories; directories are searched recursively for *.db files.
+    :return: A sorted list of database file paths.
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found.update(glob.glob(os.path.join(path, "**", "*.db"), recursive=True))
+        else:
+            found.add(path)
+    return sorted(found)
+
+
+def _connect_read_only(path):
+    return sqlite3.connect(Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+
+
+def _is_habit_database(path):
+    db = _connect_read_only(path)
+    try:
+        cur = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counter'")
+        return cur.fetchone() is not None
+    finally:
+        db.close()
+
+
+def run_job(job, path):
+    """
+    Runs a maintenance job on one database file. Files without a counter table are skipped, so other SQLite files
+    found by discover are left untouched. The integrity job opens the file read-only; the other jobs open it with
+    get_db, which also brings it to the current schema.
+
+    :param job: The name of the job, one of JOBS.
+    :param path: The database file.
+    :return: A dict with the path, the status ("ok", "failed", "skipped" or "error"), the job's detail and the
+             duration.
+    """
+    start = time.perf_counter()
+    try:
+        if not _is_habit_database(path):
+            return {"path": path, "status": "skipped", "detail": "not a habit database",
+                    "seconds": time.perf_counter() - start}
+        db = _connect_read_only(path) if job == "integrity" else get_db(path)
+        try:
+            ok, detail = JOBS[job](db)
+        finally:
+            db.close()
+        status = "ok" if ok else "failed"
+    except Exception as error:
+        status, detail = "error", f"{type(error).__name__}: {error}"
+    return {"path": path, "status": status, "detail": detail, "seconds": time.perf_counter() - start}
+
+
+def _save_state(state_file, state):
+    # written to a temporary file first, so an interrupted run never leaves a broken state file behind
+    with open(state_file + ".tmp", "w") as file:
+        json.dump(state, file, indent=2)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def run_maintenance(paths, job, workers=None, state_file=None, progress=print):
+    """
+    Runs a maintenance job across many database files in a process pool. With a state file, the files that were
+    maintained successfully are recorded as they finish, and a later run of the same job skips them, so an
+    interrupted run continues where it stopped.
+
+    :param paths: Database files and directories, see discover.
+    :param job: The name of the job: "integrity", "recompute", "vacuum" or "orphans".
+    :param workers: The maximum number of worker processes, defaults to the number of CPUs.
+    :param state_file: Optional. The JSON file the progress is kept in.
+    :param progress: Called with a progress message for every finished file.
+    :return: A dict mapping the paths of the files processed in this run to the results of run_job.
+    """
+    if job not in JOBS:
+        raise ValueError(f"Unknown job {job!r}, expected one of {', '.join(JOBS)}.")
+    state = {"job": job, "done": {}}
+    if state_file and os.path.exists(state_file):
+        with open(state_file) as file:
+            saved = json.load(file)
+        if saved.get("job") == job:
+            state = saved
+
+    files = discover(paths)
+    pending = [path for path in files if state["done"].get(path, {}).get("status") not in ("ok", "skipped")]
+    finished = len(files) - len(pending)
+    if finished:
+        progress(f"Skipping {finished} files already maintained by an earlier run.")
+
+    results = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_job, job, path) for path in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result["path"]] = result
+                finished += 1
+                progress(f"[{finished}/{len(files)}] {result['path']}: {result['status']} in {result['seconds']:.2f}s"
+                         f" ({result['detail']})")
+                if state_file:
+                    state["done"][result["path"]] = {"status": result["status"], "seconds": result["seconds"]}
+                    _save_state(state_file, state)
+    return results
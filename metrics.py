@@ -0,0 +1,171 @@
+import threading
+import time
+from functools import wraps
+
+# upper bounds of the latency histogram buckets in seconds, like the default buckets of Prometheus clients
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# the progress handler runs every this many SQLite virtual machine instructions; counting them approximates the
+# rows scanned, which the sqlite3 module does not report
+VM_STEP_GRANULARITY = 100
+
+enabled = False
+_operations = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class OperationStats:
+    __slots__ = ("calls", "errors", "seconds", "buckets", "statements", "vm_steps")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last bucket counts the calls slower than BUCKETS[-1]
+        self.statements = 0
+        self.vm_steps = 0
+
+
+def enable():
+    """
+    Starts collecting metrics for the instrumented functions.
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """
+    Stops collecting metrics. The instrumented functions then only pay for one global check per call.
+    """
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    Drops all collected metrics.
+    """
+    with _lock:
+        _operations.clear()
+
+
+def _trace(statement):
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1][0] += 1
+
+
+def _progress():
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1][1] += VM_STEP_GRANULARITY
+    return 0  # a non-zero value would abort the statement
+
+
+def instrument(operation):
+    """
+    Decorator recording the call count, latency histogram, executed SQL statements and SQLite virtual machine steps of
+    a function taking a database connection as its first argument. Statements of nested instrumented functions are
+    counted for the innermost one only.
+
+    :param operation: The name the metrics are reported under.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(db, *args, **kwargs):
+            if not enabled:
+                return function(db, *args, **kwargs)
+
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+            counters = [0, 0]  # statements, vm steps
+            stack.append(counters)
+            outermost = len(stack) == 1 and hasattr(db, "set_trace_callback")
+            if outermost:
+                db.set_trace_callback(_trace)
+                db.set_progress_handler(_progress, VM_STEP_GRANULARITY)
+            failed = False
+            start = time.perf_counter()
+            try:
+                return function(db, *args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if outermost:
+                    db.set_trace_callback(None)
+                    db.set_progress_handler(None, 0)
+                _record(operation, elapsed, counters, failed)
+        return wrapper
+    return decorator
+
+
+def _record(operation, elapsed, counters, failed):
+    bucket = next((index for index, bound in enumerate(BUCKETS) if elapsed <= bound), len(BUCKETS))
+    with _lock:
+        stats = _operations.get(operation)
+        if stats is None:
+            stats = _operations[operation] = OperationStats()
+        stats.calls += 1
+        stats.errors += failed
+        stats.seconds += elapsed
+        stats.buckets[bucket] += 1
+        stats.statements += counters[0]
+        stats.vm_steps += counters[1]
+
+
+def collect():
+    """
+    Returns the collected metrics.
+
+    :return: A dict mapping operation names to dicts with the number of calls and errors, the total and mean latency
+             in seconds, the latency histogram as cumulative counts per bucket upper bound, the executed SQL
+             statements and the approximate SQLite virtual machine steps.
+    """
+    with _lock:
+        result = {}
+        for operation, stats in sorted(_operations.items()):
+            cumulative, histogram = 0, {}
+            for bound, count in zip(BUCKETS + (float("inf"),), stats.buckets):
+                cumulative += count
+                histogram["+Inf" if bound == float("inf") else repr(bound)] = cumulative
+            result[operation] = {"calls": stats.calls, "errors": stats.errors, "seconds": stats.seconds,
+                                 "mean_seconds": stats.seconds / stats.calls, "histogram": histogram,
+                                 "statements": stats.statements, "vm_steps": stats.vm_steps}
+        return result
+
+
+def to_json():
+    """
+    Returns the collected metrics as a JSON document.
+    """
+    import json
+
+    return json.dumps(collect(), indent=2)
+
+
+def to_prometheus():
+    """
+    Returns the collected metrics in the Prometheus text exposition format.
+    """
+    metrics = collect()
+    lines = ["# HELP habit_operation_seconds Latency of habit tracker operations.",
+             "# TYPE habit_operation_seconds histogram"]
+    for operation, stats in metrics.items():
+        for bound, count in stats["histogram"].items():
+            lines.append(f'habit_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {count}')
+        lines.append(f'habit_operation_seconds_sum{{operation="{operation}"}} {stats["seconds"]}')
+        lines.append(f'habit_operation_seconds_count{{operation="{operation}"}} {stats["calls"]}')
+    for name, key, description in [("habit_operation_errors_total", "errors", "Failed calls of operations."),
+                                   ("habit_sql_statements_total", "statements", "SQL statements run by operations."),
+                                   ("habit_sqlite_vm_steps_total", "vm_steps",
+                                    "Approximate SQLite virtual machine steps of operations.")]:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for operation, stats in metrics.items():
+            lines.append(f'{name}{{operation="{operation}"}} {stats[key]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,225 @@
+from checkoff import decide, days_between
+
+
+# versioned schema migrations, applied in order by db.get_db
+def add_current_count(cur):
+    """
+    Adds the current_count column to databases created before it existed and backfills it from the tracker table.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("PRAGMA table_info(counter)")
+    if "current_count" in [column[1] for column in cur.fetchall()]:
+        return
+
+    cur.execute("ALTER TABLE counter ADD COLUMN current_count INT DEFAULT 0")
+    cur.execute("SELECT name, period FROM counter")
+    for name, period in cur.fetchall():
+        cur.execute("SELECT date FROM tracker WHERE counterName = ? ORDER BY date", (name,))
+        count, last_date = 0, None
+        for (event_date,) in cur.fetchall():
+            allowed, reset = decide(days_between(last_date, event_date), period)
+            if allowed:
+                count = 1 if reset else count + 1
+                last_date = event_date
+        cur.execute("UPDATE counter SET current_count = ? WHERE name = ?", (count, name))
+
+
+def add_lookup_indexes(cur):
+    """
+    Creates the composite indexes used by the per-habit lookups on every check-off.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tracker_counter_date ON tracker (counterName, date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_streaks_counter_length ON streaks (counterName, length)")
+
+
+def add_habit_stats(cur):
+    """
+    Creates the habit_stats table holding the per-habit values the check-off decisions and analyses need, and fills
+    it from the existing history. From then on it is kept current by the write functions in db.py.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_stats (
+        name TEXT PRIMARY KEY,
+        last_date TEXT,
+        first_date TEXT,
+        current_count INT DEFAULT 0,
+        total_checkoffs INT DEFAULT 0,
+        longest_streak INT DEFAULT 0,
+        longest_streak_date TEXT,
+        FOREIGN KEY(name) REFERENCES counter(name))""")
+    cur.execute("""INSERT OR REPLACE INTO habit_stats (name, last_date, first_date, current_count, total_checkoffs)
+                   SELECT c.name, MAX(t.date), MIN(t.date), c.current_count, COUNT(t.date)
+                   FROM counter c LEFT JOIN tracker t ON t.counterName = c.name GROUP BY c.name""")
+    cur.execute("""UPDATE habit_stats SET
+                   longest_streak = COALESCE((SELECT MAX(length) FROM streaks WHERE counterName = habit_stats.name), 0),
+                   longest_streak_date = (SELECT date FROM streaks WHERE counterName = habit_stats.name
+                                          ORDER BY length DESC, rowid LIMIT 1)""")
+
+
+# julianday() of day ordinal 0, so julianday(date) - JULIAN_DAY_OFFSET is the date's day ordinal
+JULIAN_DAY_OFFSET = 1721424.5
+
+
+def store_dates_as_days(cur):
+    """
+    Converts the TEXT date columns of tracker, streaks and habit_stats to INTEGER day ordinals. SQLite cannot change
+    the type of a column, so each table is rebuilt (keeping its rowids) and its indexes are recreated.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    def to_day(column):
+        return f"CAST(julianday({column}) - {JULIAN_DAY_OFFSET} AS INTEGER)"
+
+    tables = {
+        "tracker": ("date", """date INTEGER,
+            counterName TEXT,
+            FOREIGN KEY(counterName) REFERENCES counter(name)""",
+                    "rowid, date, counterName", f"rowid, {to_day('date')}, counterName"),
+        "streaks": ("date", """date INTEGER,
+            counterName TEXT,
+            length INT,
+            FOREIGN KEY(counterName) REFERENCES counter(name)""",
+                    "rowid, date, counterName, length", f"rowid, {to_day('date')}, counterName, length"),
+        "habit_stats": ("last_date", """name TEXT PRIMARY KEY,
+            last_date INTEGER,
+            first_date INTEGER,
+            current_count INT DEFAULT 0,
+            total_checkoffs INT DEFAULT 0,
+            longest_streak INT DEFAULT 0,
+            longest_streak_date INTEGER,
+            FOREIGN KEY(name) REFERENCES counter(name)""",
+                        "name, last_date, first_date, current_count, total_checkoffs, longest_streak, "
+                        "longest_streak_date",
+                        f"name, {to_day('last_date')}, {to_day('first_date')}, current_count, total_checkoffs, "
+                        f"longest_streak, {to_day('longest_streak_date')}"),
+    }
+    for table, (date_column, columns, names, values) in tables.items():
+        cur.execute(f"PRAGMA table_info({table})")
+        if dict((column[1], column[2]) for column in cur.fetchall())[date_column] == "INTEGER":
+            continue  # created with integer dates already
+        cur.execute(f"CREATE TABLE {table}_days ({columns})")
+        cur.execute(f"INSERT INTO {table}_days ({names}) SELECT {values} FROM {table}")
+        cur.execute(f"DROP TABLE {table}")
+        cur.execute(f"ALTER TABLE {table}_days RENAME TO {table}")
+    add_lookup_indexes(cur)
+
+
+def add_due_schedule(cur):
+    """
+    Adds the next_due and breaks_at columns to habit_stats, fills them from the last check-offs and indexes them, so
+    due and overdue habits are found with index range scans.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("ALTER TABLE habit_stats ADD COLUMN next_due INTEGER")
+    cur.execute("ALTER TABLE habit_stats ADD COLUMN breaks_at INTEGER")
+    period_days = "(SELECT CASE period WHEN 'Daily' THEN 1 ELSE 7 END FROM counter WHERE name = habit_stats.name)"
+    cur.execute(f"""UPDATE habit_stats SET next_due = last_date + {period_days},
+                    breaks_at = last_date + {period_days} + 1""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_habit_stats_next_due ON habit_stats (next_due)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_habit_stats_breaks_at ON habit_stats (breaks_at)")
+
+
+def add_archive(cur):
+    """
+    Adds the archive table holding old check-offs as compressed blobs of day ordinals, one row per habit and archival
+    run, see archive.archive_history.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS archive (
+        name TEXT,
+        first_date INTEGER,
+        last_date INTEGER,
+        count INTEGER,
+        days BLOB)""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_name_first ON archive (name, first_date)")
+
+
+def add_schedule_changes(cur):
+    """
+    Adds the indexed changed column to habit_stats. Writers set it to a new change number whenever they move a
+    habit's next_due and breaks_at, so scheduler.DueScheduler can read the habits whose events moved to days it has
+    processed already without reading every habit.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("ALTER TABLE habit_stats ADD COLUMN changed INTEGER DEFAULT 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_habit_stats_changed ON habit_stats (changed)")
+
+
+def add_streak_date_index(cur):
+    """
+    Creates the index iter_streaks pages a habit's streaks over, in the order of its (date, rowid) keyset.
+
+    :param cur: A cursor of the database being migrated.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_streaks_counter_date ON streaks (counterName, date)")
+
+
+# ordered list of (version, migration step); append new steps at the end and never renumber
+MIGRATIONS = [
+    (1, add_current_count),
+    (2, add_lookup_indexes),
+    (3, add_habit_stats),
+    (4, store_dates_as_days),
+    (5, add_due_schedule),
+    (6, add_archive),
+    (7, add_schedule_changes),
+    (8, add_streak_date_index),
+]
+
+
+def get_schema_version(db):
+    """
+    Returns the schema version of a database, creating the schema_version table if needed.
+
+    :param db: An initialized sqlite3 database connection.
+    :return: The version of the last applied migration, 0 for a database that was never migrated.
+    """
+    with db:
+        cur = db.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        version = cur.fetchone()[0]
+    return version or 0
+
+
+def migrate(db):
+    """
+    Applies all pending migrations in order. Every step runs in its own transaction together with the version bump,
+    so an interrupted upgrade can simply be run again.
+
+    :param db: An initialized sqlite3 database connection.
+    :return: The schema version after migrating.
+    """
+    version = get_schema_version(db)
+    pending = [(step_version, step) for step_version, step in MIGRATIONS if step_version > version]
+    if not pending:
+        return version
+    # the table rebuilds copy rows of habits that older versions of delete_habit left behind, which the foreign keys
+    # would reject; the pragma has no effect inside a transaction, so it is switched off around the steps
+    foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
+    db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for step_version, step in pending:
+            cur = db.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # another connection may have applied the step while this one waited for the write lock
+                cur.execute("SELECT MAX(version) FROM schema_version")
+                if (cur.fetchone()[0] or 0) < step_version:
+                    step(cur)
+                    cur.execute("INSERT INTO schema_version (version) VALUES (?)", (step_version,))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            version = step_version
+    finally:
+        db.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    return version
@@ -0,0 +1,169 @@
+from collections import Counter
+import numpy as np
+from checkoff import allowed_days, decide, from_day, schedule
+from cache import invalidate
+from metrics import instrument
+from db import retry_on_busy, iter_archived_days, next_change
+
+
+def load_days(db):
+    """
+    Loads the check-off dates of every habit as sorted NumPy arrays of day ordinals.
+
+    :param db: An initialized sqlite3 database connection.
+    :return: A dict mapping each habit name in the counter table to a tuple (period, days).
+    """
+    with db:
+        return _load_days(db.cursor())
+
+
+def _load_days(cur):
+    cur.execute("SELECT name, period FROM counter")
+    periods = dict(cur.fetchall())
+    cur.execute("SELECT counterName, date FROM tracker ORDER BY counterName, date")
+    rows = cur.fetchall()
+
+    habits = {name: (period, np.empty(0, dtype=np.int64)) for name, period in periods.items()}
+    if rows:
+        names = np.array([row[0] for row in rows], dtype=object)
+        days = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        # rows are ordered by name, so every habit is one contiguous slice
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(names)]):
+            name = names[start]
+            if name in habits:
+                habits[name] = (habits[name][0], days[start:end])
+
+    # archived check-offs are older than the live ones, so they go in front
+    cur.execute("SELECT DISTINCT name FROM archive")
+    for name in [row[0] for row in cur.fetchall() if row[0] in habits]:
+        period, days = habits[name]
+        archived = np.fromiter(iter_archived_days(cur, name), dtype=np.int64)
+        habits[name] = (period, np.concatenate([archived, days]))
+    return habits
+
+
+def _replay(days, period):
+    """
+    Replays the check-off rules event by event. Only used for histories that contain events the rules would have
+    rejected, e.g. after manual edits of the tracker table.
+    """
+    streaks, count, last_day = [], 0, None
+    for day in days.tolist():
+        allowed, reset = decide(None if last_day is None else day - last_day, period)
+        if not allowed:
+            continue
+        if reset:
+            streaks.append((day, count))
+            count = 1
+        else:
+            count += 1
+        last_day = day
+    return streaks, count
+
+
+def compute_streaks(days, period):
+    """
+    Computes the streak history and current count of one habit from its check-off days.
+
+    :param days: A sorted NumPy array of day ordinals.
+    :param period: The period of the habit ('Daily' or 'Weekly').
+    :return: A tuple (streaks, current_count) where streaks is a list of (day ordinal, length) tuples, recorded on
+             the day of the check-off that broke the streak, like increment_counter does.
+    """
+    if len(days) == 0:
+        return [], 0
+
+    differences = np.diff(days)
+    allowed_difference = allowed_days(period)
+    if np.any(differences < allowed_difference):
+        return _replay(days, period)
+
+    # a check-off more than one period after the previous one starts a new streak
+    breaks = np.flatnonzero(differences > allowed_difference) + 1
+    lengths = np.diff(np.r_[0, breaks, len(days)])
+    streaks = list(zip(days[breaks].tolist(), lengths[:-1].tolist()))
+    return streaks, int(lengths[-1])
+
+
+@instrument("recompute")
+@retry_on_busy
+def recompute(db, verify=False):
+    """
+    Rebuilds the streaks table, every habit's current_count and the habit_stats table from the tracker table in one
+    transaction. Streak rows of habits that no longer exist are dropped.
+
+    :param db: An initialized sqlite3 database connection.
+    :param verify: If True, nothing is written and the differences to the stored tables are returned instead.
+    :return: A dict mapping each habit whose stored state differs from the recomputed one to a dict with the
+             "missing" and "unexpected" streak rows, the "stored" and "computed" current counts and whether its
+             statistics are consistent ("stats_consistent").
+    """
+    cur = db.cursor()
+    cur.execute("BEGIN" if verify else "BEGIN IMMEDIATE")
+    try:
+        differences = _recompute(cur, verify)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if not verify:
+        invalidate(db)
+    return differences
+
+
+def _recompute(cur, verify):
+    computed_streaks, computed_counts, computed_stats = [], [], {}
+    for name, (period, days) in _load_days(cur).items():
+        streaks, count = compute_streaks(days, period)
+        computed_streaks.extend((day, name, length) for day, length in streaks)
+        computed_counts.append((count, name))
+
+        # the first streak of the maximum length is the longest one
+        longest_day, longest = max(streaks, key=lambda streak: streak[1]) if streaks else (None, 0)
+        first_day, last_day = (int(days[0]), int(days[-1])) if len(days) else (None, None)
+        computed_stats[name] = ((last_day, first_day, count, len(days), longest, longest_day)
+                                + schedule(last_day, period))
+
+    cur.execute("SELECT date, counterName, length FROM streaks")
+    stored_streaks = cur.fetchall()
+    cur.execute("SELECT current_count, name FROM counter")
+    stored_counts = dict((name, count) for count, name in cur.fetchall())
+    cur.execute("""SELECT name, last_date, first_date, current_count, total_checkoffs, longest_streak,
+                   longest_streak_date, next_due, breaks_at, changed FROM habit_stats""")
+    rows = cur.fetchall()
+    stored_stats = dict((row[0], row[1:-1]) for row in rows)
+    stored_changes = dict((row[0], row[-1]) for row in rows)
+
+    computed_count_map = dict((name, count) for count, name in computed_counts)
+    missing = Counter(computed_streaks) - Counter(stored_streaks)
+    unexpected = Counter(stored_streaks) - Counter(computed_streaks)
+    names = [row[1] for row in missing.elements()] + [row[1] for row in unexpected.elements()]
+    names += [name for name, count in computed_count_map.items() if stored_counts.get(name) != count]
+    names += [name for name in computed_stats.keys() | stored_stats.keys()
+              if stored_stats.get(name) != computed_stats.get(name)]
+
+    differences = {}
+    for name in names:
+        differences.setdefault(name, {"missing": [], "unexpected": [],
+                                      "stored": stored_counts.get(name), "computed": computed_count_map.get(name),
+                                      "stats_consistent": stored_stats.get(name) == computed_stats.get(name)})
+    for day, name, length in sorted(missing.elements()):
+        differences[name]["missing"].append((from_day(day), length))
+    for day, name, length in sorted(unexpected.elements()):
+        differences[name]["unexpected"].append((from_day(day), length))
+
+    if not verify and differences:
+        cur.execute("DELETE FROM streaks")
+        cur.executemany("INSERT INTO streaks (date, counterName, length) VALUES (?, ?, ?)", sorted(computed_streaks))
+        cur.executemany("UPDATE counter SET current_count = ? WHERE name = ?", computed_counts)
+        # only habits whose next_due and breaks_at move get a new change number, see scheduler.DueScheduler
+        change = next_change(cur)
+        changes = {name: stored_changes[name] if stored_stats.get(name, ())[-2:] == values[-2:] else change
+                   for name, values in computed_stats.items()}
+        cur.execute("DELETE FROM habit_stats")
+        cur.executemany("""INSERT INTO habit_stats (last_date, first_date, current_count, total_checkoffs,
+                           longest_streak, longest_streak_date, next_due, breaks_at, changed, name)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [values + (changes[name], name) for name, values in computed_stats.items()])
+    return differences
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from db import get_db, get_habit_stats, iter_streaks
+from rollups import rollup
+
+MANIFEST = "report.json"
+CALENDAR_WEEKS = 53
+# bump when the drawing code changes, so every figure is rendered again
+RENDER_VERSION = 1
+
+
+def draw_streak_chart(figure, name, dates, lengths):
+    """
+    Draws the streak history of a habit as a bar chart.
+
+    :param figure: A matplotlib Figure to draw on.
+    :param name: The name of the habit, used as the title.
+    :param dates: The dates the streaks were recorded on, as "YYYY-MM-DD" strings.
+    :param lengths: The streak lengths.
+    """
+    ax = figure.subplots()
+    # a date axis instead of one category per streak keeps long histories fast to draw and readable
+    ax.bar([date.fromisoformat(streak_date) for streak_date in dates], lengths)
+    ax.set_title(name)
+    ax.set_xlabel('Achievement Dates')
+    ax.set_ylabel('Achieved Streaks')
+    ax.tick_params(axis="x", labelrotation=45)
+    figure.tight_layout()
+
+
+def draw_calendar_chart(figure, name, end_date, days):
+    """
+    Draws the check-offs of the last weeks up to a day as a calendar heatmap with one column per week.
+
+    :param figure: A matplotlib Figure to draw on.
+    :param name: The name of the habit, used as the title.
+    :param end_date: The last day shown, as "YYYY-MM-DD".
+    :param days: The days with check-offs as (date, check-offs) pairs.
+    """
+    import numpy as np
+
+    last = date.fromisoformat(end_date)
+    first = last - timedelta(days=last.weekday() + 7 * (CALENDAR_WEEKS - 1))  # a Monday
+    grid = np.zeros((7, CALENDAR_WEEKS))
+    for day_str, count in days:
+        offset = (date.fromisoformat(day_str) - first).days
+        if 0 <= offset < 7 * CALENDAR_WEEKS:
+            grid[offset % 7, offset // 7] = count
+    ax = figure.subplots()
+    ax.imshow(grid, cmap="Greens", vmin=0, vmax=max(1, grid.max()), aspect="equal")
+    ax.set_title(f"{name} until {end_date}")
+    ax.set_yticks(range(7), ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+    ax.set_xticks([])
+    figure.tight_layout()
+
+
+def _render(task):
+    # runs in a worker process; figures are created without pyplot, so no display and no global state is involved
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    kind, name, data, path = task
+    figure = Figure(figsize=(10, 3) if kind == "calendar" else (8, 5))
+    if kind == "streaks":
+        draw_streak_chart(figure, name, *data)
+    else:
+        draw_calendar_chart(figure, name, *data)
+    figure.savefig(path)
+    return path
+
+
+def chart_data(db, name):
+    """
+    Reads the data behind the charts of a habit.
+
+    :param db: An initialized sqlite3 database connection.
+    :param name: The name of the habit.
+    :return: A dict mapping the chart kinds "streaks" and "calendar" to their data, without the charts that have no
+             data yet.
+    """
+    charts = {}
+    streaks = [(streak_date, length) for streak_date, _, length in iter_streaks(db, name)]
+    if streaks:
+        charts["streaks"] = ([streak_date for streak_date, _ in streaks], [length for _, length in streaks])
+    stats = get_habit_stats(db, name)
+    if stats is not None and stats[0] is not None:
+        start = str(date.fromisoformat(stats[0]) - timedelta(days=7 * CALENDAR_WEEKS))
+        days = [(day_str, count) for day_str, count, _ in rollup(db, name, "day", start, stats[0])]
+        charts["calendar"] = (stats[0], days)
+    return charts
+
+
+def _short_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:8]
+
+
+def file_stem(name):
+    """
+    Returns the part of the chart file names that identifies a habit. Names that are not safe in file names are
+    replaced by a safe version plus a short hash, so e.g. "A B" and "A_B" do not share their charts.
+
+    :param name: The name of the habit.
+    :return: The file name stem.
+    """
+    safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    return safe if safe == name else f"{safe}-{_short_hash(name)}"
+
+
+def _content_hash(kind, name, data, fmt):
+    content = json.dumps([RENDER_VERSION, kind, name, fmt, data])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def render_reports(databases, directory, formats=("png",), workers=None):
+    """
+    Renders the streak history and calendar charts of every habit in one or more databases to image files, without
+    a display. The figures are rendered in parallel by a process pool; figures whose data did not change since the
+    last run are skipped, based on content hashes stored in report.json in the output directory.
+
+    :param databases: The database file names. The charts of each database go to a sub directory named after it and
+                      a short hash of its path, so databases with the same name in different directories do not mix.
+    :param directory: The output directory.
+    :param formats: The image formats, e.g. "png" and "svg".
+    :param workers: The number of worker processes, defaults to the number of CPUs.
+    :return: A tuple (rendered, skipped) with the paths of the rendered and of the unchanged figures.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    tasks, hashes, skipped = [], {}, []
+    for database in databases:
+        stem = os.path.splitext(os.path.basename(database))[0]
+        subdirectory = os.path.join(directory, f"{stem}-{_short_hash(os.path.realpath(database))}")
+        os.makedirs(subdirectory, exist_ok=True)
+        db = get_db(database)
+        names = [row[0] for row in db.execute("SELECT name FROM counter ORDER BY name")]
+        for name in names:
+            for kind, data in chart_data(db, name).items():
+                for fmt in formats:
+                    path = os.path.join(subdirectory, f"{file_stem(name)}-{kind}.{fmt}")
+                    key = os.path.relpath(path, directory)
+                    if key in hashes:
+                        raise ValueError(f"The charts of {name!r} in {database} would overwrite other charts.")
+                    hashes[key] = _content_hash(kind, name, data, fmt)
+                    if manifest.get(key) == hashes[key] and os.path.exists(path):
+                        skipped.append(path)
+                    else:
+                        tasks.append((kind, name, data, path))
+        db.close()
+
+    rendered = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(_render, tasks, chunksize=max(1, len(tasks) // 32)))
+
+    manifest.update(hashes)
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return rendered, skipped
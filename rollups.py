@@ -0,0 +1,161 @@
+from datetime import date
+from cache import MISSING
+from checkoff import allowed_days, to_day, from_day
+from db import iter_archived_days
+from migrations import JULIAN_DAY_OFFSET
+
+# SQL expressions mapping the day ordinal in tracker.date to the first day of its day/week/month/year. Day ordinal 1
+# (0001-01-01) is a Monday, so weeks start on Mondays.
+BUCKETS = {
+    "day": "date",
+    "week": "date - (date - 1) % 7",
+    "month": f"CAST(julianday(strftime('%Y-%m-01', date + {JULIAN_DAY_OFFSET})) - {JULIAN_DAY_OFFSET} AS INTEGER)",
+    "year": f"CAST(julianday(strftime('%Y-01-01', date + {JULIAN_DAY_OFFSET})) - {JULIAN_DAY_OFFSET} AS INTEGER)",
+}
+
+
+def bucket_start(day, unit):
+    """
+    Returns the first day of the day/week/month/year containing a day.
+
+    :param day: The day ordinal.
+    :param unit: One of "day", "week", "month" or "year".
+    :return: The day ordinal of the first day of the period.
+    """
+    if unit == "day":
+        return day
+    if unit == "week":
+        return day - (day - 1) % 7
+    first = date.fromordinal(day).replace(day=1)
+    return (first if unit == "month" else first.replace(month=1)).toordinal()
+
+
+def bucket_end(start, unit):
+    """
+    Returns the last day of the period starting on a given day.
+
+    :param start: The day ordinal of the first day of the period, as returned by bucket_start.
+    :param unit: One of "day", "week", "month" or "year".
+    :return: The day ordinal of the last day of the period.
+    """
+    if unit == "day":
+        return start
+    if unit == "week":
+        return start + 6
+    first = date.fromordinal(start)
+    if unit == "month":
+        following = first.replace(year=first.year + first.month // 12, month=first.month % 12 + 1)
+    else:
+        following = first.replace(year=first.year + 1)
+    return following.toordinal() - 1
+
+
+def _count(cur, name, unit, low, high, skip=None):
+    # GROUP BY over the (counterName, date) index plus the archive; check-offs between the days in `skip` are left out
+    query = f"SELECT {BUCKETS[unit]} AS bucket, COUNT(*) FROM tracker WHERE counterName = ?"
+    params = [name]
+    if low is not None:
+        query += " AND date >= ?"
+        params.append(low)
+    if high is not None:
+        query += " AND date <= ?"
+        params.append(high)
+    if skip is not None:
+        query += " AND NOT (date >= ? AND date <= ?)"
+        params.extend(skip)
+    cur.execute(query + " GROUP BY bucket", params)
+    counts = dict(cur.fetchall())
+    # archived check-offs are counted in Python, they are only read for periods that are not cached yet
+    for day in iter_archived_days(cur, name, low, high):
+        if skip is None or not skip[0] <= day <= skip[1]:
+            bucket = bucket_start(day, unit)
+            counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+def _closed_counts(db, cur, name, unit, open_from):
+    """
+    Returns the check-offs per closed period (ending before `open_from`) of a habit. Closed periods do not change
+    anymore, so they are counted once and kept in the cache of the connection until the habit is written to.
+    """
+    cache = getattr(db, "cache", None)
+    if cache is None:
+        return _count(cur, name, unit, None, open_from - 1)
+    key = ("rollup", name)
+    entry = cache.get(key)
+    entry = {} if entry is MISSING else entry
+    if unit in entry and entry[unit][0] == open_from:
+        return entry[unit][1]
+    generation = cache.generation
+    counts = _count(cur, name, unit, None, open_from - 1)
+    cache.set(key, {**entry, unit: (open_from, counts)}, generation)
+    return counts
+
+
+def rollup(db, name, unit="week", start=None, end=None, today=None):
+    """
+    Counts the check-offs of a habit per day, week, month or year and rates them against the period of the habit.
+    The counts are computed with GROUP BY queries; the counts of past periods are cached, so repeated calls only count
+    the check-offs of the current period.
+
+    :param db: An initialized sqlite3 database connection.
+    :param name: The name of the habit.
+    :param unit: The length of the periods: "day", "week", "month" or "year".
+    :param start: Optional. The first date to include as "YYYY-MM-DD".
+    :param end: Optional. The last date to include as "YYYY-MM-DD".
+    :param today: Optional. The current date as "YYYY-MM-DD", defaults to today's date. Periods ending before it are
+                  treated as closed.
+    :return: A list of (first date of the period, check-offs, completion rate) tuples in date order. The completion
+             rate is the share of the habit's periods (days or weeks) within the period and the date range in which
+             the habit was checked off. Periods without check-offs are left out. None if the habit does not exist.
+    """
+    if unit not in BUCKETS:
+        raise ValueError(f"Unknown unit {unit!r}, expected one of {', '.join(BUCKETS)}.")
+    low = to_day(start) if start else None
+    high = to_day(end) if end else None
+    open_from = bucket_start(to_day(today or str(date.today())), unit)
+
+    # the closed periods that lie completely within the date range are taken from the cache
+    cached_low, cached_high = low, open_from - 1
+    if low is not None and bucket_start(low, unit) != low:
+        cached_low = bucket_end(bucket_start(low, unit), unit) + 1
+    if high is not None:
+        last = bucket_start(high, unit)
+        cached_high = min(cached_high, high if bucket_end(last, unit) == high else last - 1)
+
+    with db:
+        cur = db.cursor()
+        cur.execute("SELECT period FROM counter WHERE name = ?", (name,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        step = allowed_days(row[0])
+
+        counts = {}
+        if cached_low is None or cached_low <= cached_high:
+            counts = {bucket: count for bucket, count in _closed_counts(db, cur, name, unit, open_from).items()
+                      if (cached_low is None or bucket >= cached_low) and bucket <= cached_high}
+            skip = (cached_low if cached_low is not None else -1, cached_high)
+        else:
+            skip = None
+        # the open period and the periods only partly within the date range are counted directly
+        counts.update(_count(cur, name, unit, low, high, skip))
+
+    result = []
+    for bucket in sorted(counts):
+        first = bucket if low is None else max(bucket, low)
+        last = bucket_end(bucket, unit) if high is None else min(bucket_end(bucket, unit), high)
+        periods = -(-(last - first + 1) // step)  # ceiling division
+        result.append((from_day(bucket), counts[bucket], min(counts[bucket] / periods, 1)))
+    return result
+
+
+def rollups(db, unit="week", start=None, end=None, today=None):
+    """
+    Counts the check-offs of every habit per period, see rollup.
+
+    :return: A dict mapping habit names to the lists returned by rollup.
+    """
+    with db:
+        names = [row[0] for row in db.execute("SELECT name FROM counter ORDER BY name")]
+    return {name: rollup(db, name, unit, start, end, today) for name in names}
@@ -0,0 +1,75 @@
+import heapq
+from datetime import date
+from checkoff import to_day, from_day
+
+DUE = "due"
+BREAK = "break"
+
+
+class DueScheduler:
+    def __init__(self, db):
+        """
+        Fires reminders for habits that become due and ends streaks that are no longer continued, in time order.
+        Events are read with range scans over the indexed habit_stats.next_due and breaks_at columns and ordered in a
+        min-heap, so a run only touches the habits with something to do.
+
+        :param db: An initialized sqlite3 database connection.
+        """
+        self.db = db
+        self.heap = []
+        self.watermark = None  # events up to this day ordinal have been queued already
+        self.change = 0  # the habit_stats.changed number the watermark is valid for
+
+    def _queue_until(self, day):
+        cur = self.db.cursor()
+        cur.execute("BEGIN")  # one read transaction, so rows changed while reading are left to the next run
+        try:
+            cur.execute("SELECT COALESCE(MAX(changed), 0) FROM habit_stats")
+            change = cur.fetchone()[0]
+            for kind, column in ((DUE, "next_due"), (BREAK, "breaks_at")):
+                if self.watermark is None:
+                    cur.execute(f"SELECT name, {column} FROM habit_stats WHERE {column} <= ?", (day,))
+                else:
+                    # the events of the new days, plus the events that back-dated check-offs, bulk imports or
+                    # recompute moved to days that were processed already
+                    cur.execute(f"""SELECT name, {column} FROM habit_stats WHERE {column} > ? AND {column} <= ?
+                                    UNION ALL
+                                    SELECT name, {column} FROM habit_stats WHERE changed > ? AND {column} <= ?""",
+                                (self.watermark, day, self.change, self.watermark))
+                for name, event_day in cur.fetchall():
+                    heapq.heappush(self.heap, (event_day, kind, name))
+        finally:
+            self.db.commit()
+        self.change = change
+        self.watermark = day if self.watermark is None else max(self.watermark, day)
+
+    def run_until(self, on_date=None, remind=None, end_streak=None):
+        """
+        Fires all events up to a day that have not been fired by an earlier run, oldest first. Events made obsolete
+        by check-offs since they were queued are dropped.
+
+        :param on_date: Optional. The last day to process as "YYYY-MM-DD", defaults to today's date.
+        :param remind: Optional. Called as remind(name, due_date) when a habit can be checked off again.
+        :param end_streak: Optional. Called as end_streak(name, break_date) when a habit's streak is broken because
+                           it was not checked off in time.
+        :return: A list of the fired (date, kind, name) events, with kind "due" or "break".
+        """
+        day = to_day(on_date or str(date.today()))
+        self._queue_until(day)
+
+        fired = []
+        cur = self.db.cursor()
+        while self.heap and self.heap[0][0] <= day:
+            event_day, kind, name = heapq.heappop(self.heap)
+            cur.execute(f"SELECT {'next_due' if kind == DUE else 'breaks_at'} FROM habit_stats WHERE name = ?",
+                        (name,))
+            current = cur.fetchone()
+            if current is None or current[0] != event_day:
+                continue  # checked off or deleted since the event was queued
+            event_date = from_day(event_day)
+            if kind == DUE and remind is not None:
+                remind(name, event_date)
+            elif kind == BREAK and end_streak is not None:
+                end_streak(name, event_date)
+            fired.append((event_date, kind, name))
+        return fired
@@ -0,0 +1,144 @@
+import glob
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from db import get_db, get_longest_streak, ConnectionPool
+from migrations import get_schema_version
+
+USER_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class ShardRouter:
+    def __init__(self, directory, buckets=None, max_open=64):
+        """
+        Routes users to their own database files, so every user has a separate SQLite writer lock and all functions
+        of db.py (and HabitCounter) work unchanged on the connection of a user.
+
+        :param directory: The directory holding the user databases.
+        :param buckets: Optional. If given, user databases are spread over this many sub directories by a hash of the
+                        user ID, so directories stay small with many users.
+        :param max_open: The maximum number of user databases with open connections; the connections of the least
+                         recently used database that is not borrowed are closed when more are needed.
+        """
+        self.directory = directory
+        self.buckets = buckets
+        self.max_open = max_open
+        self.pools = OrderedDict()  # path -> ConnectionPool with one connection per thread
+        self.borrowed = {}  # path -> number of connection() blocks using the pool
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, user_id):
+        """
+        Returns the database file of a user.
+
+        :param user_id: The user ID, made of letters, digits, "_" and "-".
+        :return: The path of the database file (which may not exist yet).
+        """
+        user_id = str(user_id)
+        if not USER_ID.match(user_id):
+            raise ValueError(f"Invalid user ID {user_id!r}.")
+        if self.buckets is None:
+            return os.path.join(self.directory, f"user-{user_id}.db")
+        bucket = zlib.crc32(user_id.encode()) % self.buckets  # stable across processes, unlike hash()
+        return os.path.join(self.directory, f"{bucket:03d}", f"user-{user_id}.db")
+
+    @contextmanager
+    def connection(self, user_id):
+        """
+        Borrows a connection to a user's database, opening (and creating) it on first use. Every thread gets its own
+        connection, and the connections of a database are not closed while they are borrowed:
+
+            with router.connection("alice") as db:
+                increment_counter(db, "Read")
+
+        :param user_id: The user ID.
+        :return: A context manager giving an initialized database connection that must only be used by the calling
+                 thread within the with block.
+        """
+        path = self.path_for(user_id)
+        with self.lock:
+            pool = self.pools.get(path)
+            if pool is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                pool = self.pools[path] = ConnectionPool(path)
+            self.pools.move_to_end(path)
+            self.borrowed[path] = self.borrowed.get(path, 0) + 1
+            self._evict()
+        try:
+            yield pool.connection()
+        finally:
+            with self.lock:
+                self.borrowed[path] -= 1
+                if not self.borrowed[path]:
+                    del self.borrowed[path]
+                self._evict()
+
+    def _evict(self):
+        # closes the least recently used pools that are not borrowed; called with the lock held
+        for path in list(self.pools):
+            if len(self.pools) <= self.max_open:
+                break
+            if path not in self.borrowed:
+                self.pools.pop(path).close()
+
+    def users(self):
+        """
+        Returns the IDs of all users that have a database.
+        """
+        pattern = os.path.join(self.directory, "user-*.db" if self.buckets is None else os.path.join("*", "user-*.db"))
+        return sorted(os.path.basename(path)[len("user-"):-len(".db")] for path in glob.glob(pattern))
+
+    def for_each(self, function, workers=8):
+        """
+        Calls a function for every user database in parallel. Every call gets its own connection, independent of the
+        connections borrowed with connection().
+
+        :param function: Called as function(db, user_id).
+        :param workers: The number of threads.
+        :return: A dict mapping the user IDs to the results.
+        """
+        def run(user_id):
+            db = get_db(self.path_for(user_id))
+            try:
+                return function(db, user_id)
+            finally:
+                db.close()
+
+        users = self.users()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(users, executor.map(run, users)))
+
+    def leaderboard(self, limit=10, workers=8):
+        """
+        Returns the longest streaks across all users, read from every user's habit_stats table in parallel.
+
+        :param limit: The number of entries.
+        :param workers: The number of threads.
+        :return: A list of (user_id, habit, length, date) tuples, longest streaks first.
+        """
+        longest = self.for_each(lambda db, user_id: get_longest_streak(db), workers)
+        entries = [(user_id,) + streak for user_id, streak in longest.items() if streak is not None]
+        return sorted(entries, key=lambda entry: (-entry[2], entry[0]))[:limit]
+
+    def migrate(self, workers=8):
+        """
+        Brings every user database to the current schema version. Opening a database with get_db runs the migrations.
+
+        :param workers: The number of threads.
+        :return: A dict mapping the user IDs to their schema version.
+        """
+        return self.for_each(lambda db, user_id: get_schema_version(db), workers)
+
+    def close(self):
+        """
+        Closes all open connections.
+        """
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
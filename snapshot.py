@@ -0,0 +1,236 @@
+import json
+import os
+import shutil
+import numpy as np
+from db import retry_on_busy, iter_archived_days
+from cache import invalidate
+
+SNAPSHOT_VERSION = 3
+META = "meta.json"
+COUNTER = "counter.npz"
+# the columns of the exported tables; names are stored as int32 codes into the names dictionary, dates as int32 day
+# ordinals (see checkoff.to_day)
+COLUMNS = {"tracker": ("name", "day"), "streaks": ("name", "day", "length")}
+QUERIES = {"tracker": "SELECT rowid, counterName, date FROM tracker WHERE rowid > ? ORDER BY rowid",
+           "streaks": "SELECT rowid, counterName, date, length FROM streaks WHERE rowid > ? ORDER BY rowid"}
+# sums over the exported rows weighted by their rowids, so rows that were rewritten in place or deleted and inserted
+# again (as recompute does with streaks) change the fingerprint even when the number of rows stays the same
+FINGERPRINTS = {
+    "tracker": "SELECT COUNT(*), TOTAL(rowid * date), TOTAL(rowid * length(counterName)) FROM tracker WHERE rowid <= ?",
+    "streaks": "SELECT COUNT(*), TOTAL(rowid * date), TOTAL(rowid * length(counterName)), TOTAL(rowid * length) "
+               "FROM streaks WHERE rowid <= ?",
+}
+
+
+def _column_path(directory, generation, table, column):
+    return os.path.join(directory, f"{generation:06d}", f"{table}-{column}.npy")
+
+
+def _fingerprint(cur, table, rowid):
+    cur.execute(FINGERPRINTS[table], (rowid,))
+    return list(cur.fetchone())
+
+
+def _read_meta(directory):
+    path = os.path.join(directory, META)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        meta = json.load(file)
+    return meta if meta.get("version") == SNAPSHOT_VERSION else None
+
+
+def _write_snapshot(cur, directory, meta, previous=None, archived=()):
+    # writes the next generation of the snapshot into its own sub directory: every column is one .npy file holding
+    # the rows of the previous generation (if given) followed by the rows added since; archived check-offs are passed
+    # as (0, name, day) rows and written in front of the live ones
+    generation = meta["generation"]
+    target = os.path.join(directory, f"{generation:06d}")
+    shutil.rmtree(target, ignore_errors=True)  # left behind by an interrupted export
+    os.makedirs(target)
+    names = meta["names"]
+    codes = {name: code for code, name in enumerate(names)}
+    cur.execute("SELECT name, description, period, current_count FROM counter ORDER BY name")
+    counters = cur.fetchall()
+    for name, *_ in counters:
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+
+    written = {}
+    for table, columns in COLUMNS.items():
+        cur.execute(QUERIES[table], (meta["rowids"][table],))
+        live = cur.fetchall()
+        rows = list(archived) + live if table == "tracker" else live
+        written[table] = len(rows)
+        for name in {row[1] for row in rows} - codes.keys():  # rows of habits that are not in counter anymore
+            codes[name] = len(names)
+            names.append(name)
+        arrays = {"name": np.fromiter((codes[row[1]] for row in rows), np.int32, len(rows)),
+                  "day": np.fromiter((row[2] for row in rows), np.int32, len(rows))}
+        if table == "streaks":
+            arrays["length"] = np.fromiter((row[3] for row in rows), np.int32, len(rows))
+        for column in columns:
+            old = np.empty(0, dtype=np.int32)
+            if previous is not None:
+                old = np.load(_column_path(directory, previous, table, column), mmap_mode="r")
+            # the old rows are copied file to file through the page cache, so every column stays one memory map
+            merged = np.lib.format.open_memmap(_column_path(directory, generation, table, column), mode="w+",
+                                               dtype=np.int32, shape=(len(old) + len(rows),))
+            merged[:len(old)] = old
+            merged[len(old):] = arrays[column]
+            merged.flush()
+            del merged, old
+        if rows:
+            meta["rowids"][table] = max(meta["rowids"][table], rows[-1][0])
+        meta["fingerprints"][table] = _fingerprint(cur, table, meta["rowids"][table])
+
+    np.savez(os.path.join(target, COUNTER),
+             names=np.array(names, dtype=str),
+             code=np.array([codes[row[0]] for row in counters], dtype=np.int32),
+             description=np.array([row[1] or "" for row in counters], dtype=str),
+             period=np.array([row[2] or "" for row in counters], dtype=str),
+             current_count=np.array([row[3] or 0 for row in counters], dtype=np.int32))
+    # replacing meta.json switches readers to the new generation at once, so an interrupted export leaves the
+    # previous snapshot readable; older generations are removed afterwards
+    with open(os.path.join(directory, META + ".tmp"), "w") as file:
+        json.dump(meta, file, indent=2)
+    os.replace(os.path.join(directory, META + ".tmp"), os.path.join(directory, META))
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry.isdigit() and int(entry) != generation:
+            # ignore_errors, as open memory maps keep the files of older generations on some systems
+            shutil.rmtree(path, ignore_errors=True)
+        elif entry.endswith(".npy") or entry == COUNTER:  # written by earlier versions
+            os.remove(path)
+    return written
+
+
+def export_snapshot(db, directory, append=True):
+    """
+    Writes the counter, tracker and streaks tables to a directory of NumPy files, one .npy file per column, that can
+    be loaded memory-mapped with load_snapshot.
+
+    :param db: An initialized sqlite3 database connection.
+    :param directory: The snapshot directory, created if needed.
+    :param append: If True and the directory holds a snapshot of the same database, only the check-offs and streaks
+                   added since then are read from the database and appended to the columns. The snapshot is written
+                   from scratch if the tables were changed in other ways since (e.g. by recompute or delete_habit).
+    :return: A dict with the number of tracker and streaks rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cur = db.cursor()
+    cur.execute("BEGIN")  # one read transaction, so tracker and streaks are exported at the same point
+    try:
+        old = _read_meta(directory)
+        meta = old if append else None
+        if meta is not None:
+            for table in COLUMNS:
+                # check-offs and streaks are normally only appended, so the exported rows are unchanged unless they
+                # were deleted or rewritten since
+                if _fingerprint(cur, table, meta["rowids"][table]) != meta["fingerprints"][table]:
+                    meta = None
+                    break
+        if meta is not None:
+            previous = meta["generation"]
+            meta["generation"] = previous + 1
+            return _write_snapshot(cur, directory, meta, previous)
+
+        meta = {"version": SNAPSHOT_VERSION, "generation": 0 if old is None else old["generation"] + 1, "names": [],
+                "rowids": {table: 0 for table in COLUMNS},
+                "fingerprints": {table: _fingerprint(cur, table, 0) for table in COLUMNS}}
+        # archiving deletes tracker rows, so a snapshot is rewritten after it and can include the archive
+        cur.execute("SELECT DISTINCT name FROM archive ORDER BY name")
+        names = [row[0] for row in cur.fetchall()]
+        archived = [(0, name, day) for name in names for day in iter_archived_days(cur, name)]
+        return _write_snapshot(cur, directory, meta, archived=archived)
+    finally:
+        db.commit()
+
+
+class Snapshot:
+    def __init__(self, directory):
+        """
+        A snapshot written by export_snapshot. The columns of the tracker and streaks tables are memory-mapped, so
+        loading does not read or copy the data.
+
+        :param directory: The snapshot directory.
+        """
+        meta = _read_meta(directory)
+        if meta is None:
+            raise FileNotFoundError(f"No snapshot found in {directory}.")
+        self.directory = directory
+        self.meta = meta
+        generation = meta["generation"]
+        with np.load(os.path.join(directory, f"{generation:06d}", COUNTER)) as counter:
+            self.names = counter["names"]
+            self.counter = {column: counter[column] for column in ("code", "description", "period", "current_count")}
+        self.codes = {name: code for code, name in enumerate(self.names.tolist())}
+        self.tracker = {column: np.load(_column_path(directory, generation, "tracker", column), mmap_mode="r")
+                        for column in COLUMNS["tracker"]}
+        self.streaks = {column: np.load(_column_path(directory, generation, "streaks", column), mmap_mode="r")
+                        for column in COLUMNS["streaks"]}
+
+    def code(self, name):
+        """
+        Returns the code of a habit name in the name columns, or -1 if the habit is not in the snapshot.
+        """
+        return self.codes.get(name, -1)
+
+    def days(self, name):
+        """
+        Returns the check-off days of a habit as day ordinals.
+        """
+        return self.tracker["day"][self.tracker["name"] == self.code(name)]
+
+
+def load_snapshot(directory):
+    """
+    Loads a snapshot written by export_snapshot.
+
+    :param directory: The snapshot directory.
+    :return: A Snapshot instance.
+    """
+    return Snapshot(directory)
+
+
+@retry_on_busy
+def import_snapshot(db, directory):
+    """
+    Restores the habits, check-offs and streaks of a snapshot into a database that does not contain these habits yet.
+    The maintained statistics are rebuilt afterwards with recompute.
+
+    :param db: An initialized sqlite3 database connection.
+    :param directory: The snapshot directory.
+    :return: The number of restored check-offs.
+    """
+    from recompute import recompute
+
+    snapshot = load_snapshot(directory)
+    names = snapshot.names.tolist()
+    counters = list(zip([names[code] for code in snapshot.counter["code"].tolist()],
+                        snapshot.counter["description"].tolist(), snapshot.counter["period"].tolist(),
+                        snapshot.counter["current_count"].tolist()))
+    with db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT name FROM counter")
+        existing = sorted({row[0] for row in cur.fetchall()} & {row[0] for row in counters})
+        if existing:
+            raise ValueError(f"The database already contains the habits {', '.join(existing)}.")
+        cur.executemany("INSERT INTO counter (name, description, period, current_count) VALUES (?, ?, ?, ?)",
+                        counters)
+        cur.executemany("INSERT INTO habit_stats (name) VALUES (?)", [(row[0],) for row in counters])
+        # rows of habits that were deleted after they were exported are left out
+        restored = {row[0] for row in counters}
+        tracker = [(day, names[code]) for code, day in zip(snapshot.tracker["name"].tolist(),
+                                                            snapshot.tracker["day"].tolist())
+                   if names[code] in restored]
+        cur.executemany("INSERT INTO tracker (date, counterName) VALUES (?, ?)", tracker)
+        cur.executemany("INSERT INTO streaks (date, counterName, length) VALUES (?, ?, ?)",
+                        [(day, names[code], length) for code, day, length in
+                         zip(snapshot.streaks["name"].tolist(), snapshot.streaks["day"].tolist(),
+                             snapshot.streaks["length"].tolist()) if names[code] in restored])
+    invalidate(db)
+    recompute(db)
+    return len(tracker)
@@ -1,45 +1,75 @@
-# import os
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import json
+import numpy
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import random
 from class_counter import HabitCounter
-from db import get_db
+from db import get_db, increment_counter, get_streak_data, get_last_check, get_habit_stats, delete_habit, \
+    get_habit_info, get_all_counter_names, get_all_counter_data, iter_checkoffs, iter_streaks, ConnectionPool, \
+    retry_on_busy, due_habits
+from migrations import MIGRATIONS, get_schema_version
+from checkoff import to_day
+from bulk import bulk_add_events, read_events
+from recompute import recompute
+from analyse import streak_analysis
+from cache import LRUCache
+from workload import generate_habits, generate_events, build_database, SAMPLE_HABITS
+from benchmark import run_benchmark, find_regressions
+from main import main
+from write_queue import CheckoffQueue
+from history import HabitHistory, load_histories, memory_footprint
+from scheduler import DueScheduler
+from rollups import rollup, rollups, bucket_start
+from report import render_reports, file_stem
+from snapshot import export_snapshot, load_snapshot, import_snapshot
+from shard import ShardRouter
+import metrics
+from fixtures import habit_database, template_database
+from archive import archive_history, compact
+from maintenance import run_maintenance, discover, JOBS
+
+
+# the habit_stats columns that follow from the check-offs; habit_stats.changed depends on how they were written
+STATS_COLUMNS = "name, last_date, first_date, current_count, total_checkoffs, longest_streak, longest_streak_date, " \
+                "next_due, breaks_at"
+
+
+def assert_same_tables(first, second):
+    # compares the tables two write paths produced from the same check-offs
+    for query in ["SELECT * FROM tracker ORDER BY counterName, date",
+                  "SELECT * FROM streaks ORDER BY counterName, date",
+                  "SELECT * FROM counter ORDER BY name",
+                  f"SELECT {STATS_COLUMNS} FROM habit_stats ORDER BY name"]:
+        assert first.execute(query).fetchall() == second.execute(query).fetchall()
+
+
+def create_baseline_database(path):
+    # a database in the layout of the first release (TEXT dates, no current_count), with the check-offs and streak of
+    # a deleted habit left behind
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE counter (name TEXT PRIMARY KEY, description TEXT, period TEXT);
+        CREATE TABLE tracker (date TEXT, counterName TEXT, FOREIGN KEY(counterName) REFERENCES counter(name));
+        CREATE TABLE streaks (date TEXT, counterName TEXT, length INT,
+                              FOREIGN KEY(counterName) REFERENCES counter(name));
+        INSERT INTO counter VALUES ('Read', 'Read for at least 30 minutes', 'Daily');
+        INSERT INTO tracker VALUES ('2024-01-01', 'Read'), ('2024-01-01', 'Gone'), ('2024-01-02', 'Gone');
+        INSERT INTO streaks VALUES ('2024-01-02', 'Gone', 2);""")
+    db.close()
 
 
 class TestCounter:
     def setup_method(self):
-        # Creating a test database
-        self.db = get_db("test.db")
-        self.counters = []
-
-        # Define daily and weekly counters
-        daily_habits = [("Drink Water", "Drink at least 8 glasses of water", "Daily"),
-                        ("Read", "Read for at least 30 minutes", "Daily"),
-                        ("Exercise", "Do some form of exercise", "Daily")]
-        weekly_habits = [("Clean House", "Weekly house cleaning", "Weekly"),
-                         ("Call Family", "Call family members", "Weekly")]
-
-        # Adding counters to the database using the store method of HabitCounter
-        for habit in daily_habits + weekly_habits:
-            name, description, period = habit
-            counter = HabitCounter(name, description, period)
-            counter.store(self.db)  # saves counter into db
-            self.counters.append(counter)  # HabitCounter instance added to list
-
-        # Generate random check - offs for the first 29 days for each habit
-        start_date = datetime.strptime("2024-03-10", "%Y-%m-%d")  # Start from March 10th
-        for day in range(25):  # Generate entries for the first 29 days
-            current_date = start_date + timedelta(days=day)
-            for counter in self.counters:
-                # Randomly skip some days for daily and weekly habits
-                if random.choice([True, False]):
-                    event_date_str = current_date.strftime("%Y-%m-%d")
-                    counter.add_event(self.db, event_date_str)
-
-        today = datetime.now()
-        for counter in self.counters:
-            for days_back in [12, 11, 9, 8, 7, 6, 5, 3, 2, 1]:
-                date_str = (today - timedelta(days=days_back)).strftime("%Y-%m-%d")
-                counter.add_event(self.db, date_str)
+        # every test gets its own copy of a seeded template database with three daily and two weekly habits and
+        # a year of random check-offs, built once per test session
+        self.db, self.counters, _ = habit_database(habits=5, years=1, start_date="2024-03-10")
 
     def test_counter_logic1(self):
         #  for days_back in [2, 3]:  # For the last two days
@@ -48,5 +78,951 @@ class TestCounter:
 
     def teardown_method(self):
         self.db.close()
-        #  if os.path.exists("test.db"):
-        #    os.remove("test.db")
+
+
+class TestCheckoff:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(self.db)
+        HabitCounter("Clean House", "Weekly house cleaning", "Weekly").store(self.db)
+
+    def test_daily_checkoff_and_reset(self):
+        assert increment_counter(self.db, "Read", "2024-03-10")
+        assert not increment_counter(self.db, "Read", "2024-03-10")  # same day is not allowed
+        assert increment_counter(self.db, "Read", "2024-03-11")
+        assert increment_counter(self.db, "Read", "2024-03-14")  # gap breaks the streak
+
+        assert get_streak_data(self.db, "Read") == [("2024-03-14", "Read", 2)]
+        assert self.db.execute("SELECT current_count FROM counter WHERE name = 'Read'").fetchone()[0] == 1
+        assert len(get_last_check(self.db, "Read")) == 3
+
+    def test_weekly_checkoff(self):
+        assert increment_counter(self.db, "Clean House", "2024-03-10")
+        assert not increment_counter(self.db, "Clean House", "2024-03-16")
+        assert increment_counter(self.db, "Clean House", "2024-03-17")
+        assert increment_counter(self.db, "Clean House", "2024-03-25")
+
+        assert get_streak_data(self.db, "Clean House") == [("2024-03-25", "Clean House", 2)]
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestMigrations:
+    def test_upgrade_old_layout(self, tmp_path):
+        # main.db was created before current_count and the indexes existed
+        path = tmp_path / "main.db"
+        shutil.copy("main.db", path)
+        old = sqlite3.connect(path)
+        tracker_rows = old.execute("SELECT * FROM tracker ORDER BY rowid").fetchall()
+        old.close()
+
+        db = get_db(str(path))
+        assert get_schema_version(db) == MIGRATIONS[-1][0]
+        columns = [column[1] for column in db.execute("PRAGMA table_info(counter)")]
+        assert "current_count" in columns
+        indexes = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert "idx_tracker_counter_date" in indexes
+        assert "idx_streaks_counter_length" in indexes
+        # dates are converted to day ordinals in place and back at the API boundary
+        assert db.execute("SELECT * FROM tracker ORDER BY rowid").fetchall() == [
+            (to_day(event_date), name) for event_date, name in tracker_rows]
+        assert db.execute("SELECT DISTINCT typeof(date) FROM tracker").fetchall() == [("integer",)]
+        assert get_last_check(db, "a") == [row for row in tracker_rows if row[1] == "a"]
+        # the backfilled count lets check-offs continue the existing history
+        assert db.execute("SELECT current_count FROM counter WHERE name = 'a'").fetchone()[0] > 0
+        db.close()
+
+        # reopening an up-to-date database is a no-op
+        db = get_db(str(path))
+        assert db.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(MIGRATIONS)
+        db.close()
+
+    def test_upgrade_with_orphaned_rows(self, tmp_path):
+        # older versions of delete_habit left the tracker and streaks rows of deleted habits behind
+        path = str(tmp_path / "orphans.db")
+        create_baseline_database(path)
+        db = get_db(path)
+        assert get_schema_version(db) == MIGRATIONS[-1][0]
+        assert db.execute("SELECT COUNT(*) FROM tracker WHERE counterName = 'Gone'").fetchone()[0] == 2
+        assert db.execute("SELECT date, length FROM streaks WHERE counterName = 'Gone'").fetchall() == [
+            (to_day("2024-01-02"), 2)]
+        assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert get_last_check(db, "Read") == [("2024-01-01", "Read")]
+        db.close()
+
+
+class TestBulkImport:
+    def setup_method(self):
+        self.habits = [HabitCounter("Read", "Read for at least 30 minutes", "Daily"),
+                       HabitCounter("Call Family", "Call family members", "Weekly")]
+        rng = random.Random(7)
+        start_date = datetime.strptime("2024-01-01", "%Y-%m-%d")
+        self.events = [(habit.name, (start_date + timedelta(days=day)).strftime("%Y-%m-%d"))
+                       for day in range(120) for habit in self.habits if rng.random() < 0.6]
+
+    def test_retry_reads_all_events(self, tmp_path):
+        path = str(tmp_path / "busy.db")
+        db = get_db(path)
+        for habit in self.habits:
+            habit.store(db)
+        events_file = tmp_path / "events.csv"
+        events_file.write_text("name,date\n" + "".join(f"{name},{event_date}\n" for name, event_date in self.events))
+        db.execute("PRAGMA busy_timeout = 0")  # fail at once, so the import goes through retry_on_busy
+
+        other = get_db(path, check_same_thread=False)
+        other.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.1, other.rollback)
+        timer.start()
+        accepted, rejected = bulk_add_events(db, read_events(events_file))
+        timer.join()
+
+        assert accepted + rejected == len(self.events)
+        assert accepted == db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] > 0
+        other.close()
+        db.close()
+
+    def test_matches_single_checkoffs(self):
+        single, bulk = get_db(":memory:"), get_db(":memory:")
+        for habit in self.habits:
+            habit.store(single)
+            habit.store(bulk)
+        for name, event_date in self.events:
+            increment_counter(single, name, event_date)
+
+        shuffled = self.events[:]
+        random.Random(1).shuffle(shuffled)
+        accepted, rejected = bulk_add_events(bulk, shuffled + [("Unknown", "2024-01-01")])
+
+        assert accepted == len(get_last_check(single, "Read")) + len(get_last_check(single, "Call Family"))
+        assert accepted + rejected == len(self.events) + 1
+        assert_same_tables(single, bulk)
+
+    def test_read_events(self, tmp_path):
+        csv_path = tmp_path / "events.csv"
+        csv_path.write_text("name,date\nRead,2024-01-01\nRead,2024-01-02\n")
+        jsonl_path = tmp_path / "events.jsonl"
+        jsonl_path.write_text('{"name": "Read", "date": "2024-01-01"}\n\n{"name": "Read", "date": "2024-01-02"}\n')
+
+        expected = [("Read", "2024-01-01"), ("Read", "2024-01-02")]
+        assert list(read_events(csv_path)) == expected
+        assert list(read_events(jsonl_path)) == expected
+
+
+class TestRecompute:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        habits = [HabitCounter("Read", "Read for at least 30 minutes", "Daily"),
+                  HabitCounter("Call Family", "Call family members", "Weekly")]
+        rng = random.Random(3)
+        start_date = datetime.strptime("2024-01-01", "%Y-%m-%d")
+        for habit in habits:
+            habit.store(self.db)
+        for day in range(200):
+            for habit in habits:
+                if rng.random() < 0.7:
+                    habit.add_event(self.db, (start_date + timedelta(days=day)).strftime("%Y-%m-%d"))
+        self.streaks = get_streak_data(self.db, "Overall")
+        self.counters = self.db.execute("SELECT * FROM counter ORDER BY name").fetchall()
+        self.stats = self.db.execute(f"SELECT {STATS_COLUMNS} FROM habit_stats ORDER BY name").fetchall()
+
+    def test_consistent_database(self):
+        assert recompute(self.db, verify=True) == {}
+
+    def test_repair(self):
+        self.db.execute("PRAGMA foreign_keys = OFF")  # orphaned rows as left behind by older versions
+        self.db.execute("DELETE FROM streaks WHERE counterName = 'Read'")
+        self.db.execute("INSERT INTO streaks VALUES (?, 'Deleted', 4)", (to_day("2024-01-05"),))
+        self.db.execute("UPDATE counter SET current_count = 99 WHERE name = 'Call Family'")
+        self.db.execute("DELETE FROM habit_stats WHERE name = 'Read'")
+        self.db.commit()
+
+        differences = recompute(self.db, verify=True)
+        assert set(differences) == {"Read", "Deleted", "Call Family"}
+        assert differences["Call Family"]["stored"] == 99
+        assert differences["Deleted"]["unexpected"] == [("2024-01-05", 4)]
+
+        recompute(self.db)
+        assert sorted(get_streak_data(self.db, "Overall")) == sorted(self.streaks)
+        assert self.db.execute("SELECT * FROM counter ORDER BY name").fetchall() == self.counters
+        assert self.db.execute(f"SELECT {STATS_COLUMNS} FROM habit_stats ORDER BY name").fetchall() == self.stats
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestHabitStats:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        self.habits = [HabitCounter("Read", "Read for at least 30 minutes", "Daily"),
+                       HabitCounter("Call Family", "Call family members", "Weekly")]
+        rng = random.Random(5)
+        start_date = datetime.strptime("2024-01-01", "%Y-%m-%d")
+        for habit in self.habits:
+            habit.store(self.db)
+        for day in range(150):
+            for habit in self.habits:
+                if rng.random() < 0.7:
+                    habit.add_event(self.db, (start_date + timedelta(days=day)).strftime("%Y-%m-%d"))
+
+    def test_stats_match_history(self):
+        for habit in self.habits:
+            dates = sorted(row[0] for row in get_last_check(self.db, habit.name))
+            lengths = [streak[2] for streak in get_streak_data(self.db, habit.name)]
+            current_count = self.db.execute("SELECT current_count FROM counter WHERE name = ?",
+                                            (habit.name,)).fetchone()[0]
+            assert get_habit_stats(self.db, habit.name)[:5] == (dates[-1], dates[0], current_count, len(dates),
+                                                                max(lengths))
+
+    def test_overall_longest_streak(self, capsys):
+        streaks = get_streak_data(self.db, "Overall")
+        longest = max(streak[2] for streak in streaks)
+        streak_analysis(self.db, "Overall")
+        assert f"was {longest} times in a row" in capsys.readouterr().out
+
+    def test_delete_habit(self):
+        delete_habit(self.db, "Read")
+        assert get_habit_stats(self.db, "Read") is None
+        assert get_streak_data(self.db, "Read") == []
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestCache:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(self.db)
+
+    def test_reads_are_cached_and_invalidated(self):
+        assert get_habit_info(self.db, "Read") == (None, None)
+        assert get_habit_info(self.db, "Read") == (None, None)
+        assert self.db.cache.stats()["hits"] == 1
+
+        increment_counter(self.db, "Read", "2024-03-10")
+        assert get_habit_info(self.db, "Read") == ("2024-03-10", "Daily")
+        assert get_all_counter_data(self.db, "Daily")[0][3] == 1
+        increment_counter(self.db, "Read", "2024-03-11")
+        assert get_all_counter_data(self.db, "Daily")[0][3] == 2
+
+        names = get_all_counter_names(self.db)
+        names.append("Overall")  # callers may modify the returned list
+        assert get_all_counter_names(self.db) == ["Read"]
+        HabitCounter("Exercise", "Do some form of exercise", "Daily").store(self.db)
+        assert sorted(get_all_counter_names(self.db)) == ["Exercise", "Read"]
+        delete_habit(self.db, "Read")
+        assert get_all_counter_names(self.db) == ["Exercise"]
+        assert get_habit_info(self.db, "Read") == (None, None)
+
+    def test_keyword_arguments(self):
+        increment_counter(self.db, "Read", "2024-03-10")
+        assert get_habit_info(self.db, name="Read") == get_habit_info(self.db, "Read") == ("2024-03-10", "Daily")
+        assert get_all_counter_data(self.db, period="Daily") == get_all_counter_data(self.db, "Daily")
+        assert get_habit_stats(db=self.db, name="Read") == get_habit_stats(self.db, "Read")
+        assert self.db.cache.stats()["hits"] == 3
+        increment_counter(self.db, "Read", "2024-03-11")
+        assert get_habit_info(self.db, name="Read") == ("2024-03-11", "Daily")
+
+    def test_shared_between_connections(self, tmp_path):
+        path = str(tmp_path / "shared.db")
+        writer, reader = get_db(path), get_db(path)
+        HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(writer)
+        assert get_all_counter_names(reader) == ["Read"]
+        increment_counter(writer, "Read", "2024-03-10")
+        assert get_habit_info(reader, "Read") == ("2024-03-10", "Daily")
+        writer.close()
+        reader.close()
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        for key in ["a", "b", "c"]:
+            cache.set((key,), key, cache.generation)
+        assert cache.stats()["size"] == 2
+        assert ("a",) not in cache.entries
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestBenchmark:
+    def test_workload_is_seeded(self):
+        habits = generate_habits(8)
+        assert [habit.period for habit in habits].count("Daily") == 4
+        first = list(generate_events(habits, "2024-01-01", 60, 0.3, seed=11))
+        assert first == list(generate_events(habits, "2024-01-01", 60, 0.3, seed=11))
+        assert first != list(generate_events(habits, "2024-01-01", 60, 0.3, seed=12))
+
+        db, counters, accepted = build_database(":memory:", habits=8, years=1, probability=0.3, seed=11)
+        assert db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == accepted
+        db.close()
+
+    def test_run_benchmark(self, tmp_path):
+        results = run_benchmark(sizes=[500], repeat=3, directory=tmp_path)
+        operations = results["sizes"]["500"]["operations"]
+        assert {"increment_counter", "get_habit_info", "get_last_check", "streak_analysis_overall",
+                "delete_habit"} <= set(operations)
+        assert results["cli_startup"]["runs"] == 3
+        assert find_regressions(results, results) == []
+
+
+class TestCommands:
+    def test_checkoff_list_streaks(self, tmp_path, capsys):
+        path = str(tmp_path / "commands.db")
+        db = get_db(path)
+        HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(db)
+        db.close()
+
+        assert main(["--db", path, "checkoff", "Read", "--date", "2024-03-10"]) == 0
+        assert main(["--db", path, "checkoff", "Read", "--date", "2024-03-10"]) == 1
+        assert main(["--db", path, "checkoff", "Read", "--date", "2024-03-12"]) == 0
+        assert main(["--db", path, "list", "--period", "Daily"]) == 0
+        assert "Name: Read, Description: Read for at least 30 minutes, Period: Daily, Current Count: 1" \
+            in capsys.readouterr().out
+        assert main(["--db", path, "streaks", "Read"]) == 0
+        assert "2024-03-12: 1 times in a row" in capsys.readouterr().out
+
+    def test_startup_skips_heavy_imports(self, tmp_path):
+        # guards the startup time of the non-interactive commands
+        script = ("import sys, main; main.main(['--db', sys.argv[1], 'list']); "
+                  "print(sorted({'matplotlib', 'questionary', 'numpy'} & set(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", script, str(tmp_path / "startup.db")],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+class TestHistoryStreaming:
+    def setup_method(self):
+        self.db, self.habits, _ = habit_database(habits=4, years=1, probability=0.6, seed=2)
+
+    def test_iter_checkoffs(self):
+        expected = sorted(get_last_check(self.db, "Read"))
+        assert list(iter_checkoffs(self.db, "Read", page_size=7)) == expected
+        assert list(iter_checkoffs(self.db, "Read", limit=10, page_size=3)) == expected[:10]
+        assert list(iter_checkoffs(self.db, "Read", after=expected[4][0], page_size=4)) == expected[5:]
+        in_march = [row for row in expected if "2020-03-01" <= row[0] <= "2020-03-31"]
+        assert list(iter_checkoffs(self.db, "Read", start="2020-03-01", end="2020-03-31", page_size=2)) == in_march
+
+    def test_iter_streaks(self):
+        assert list(iter_streaks(self.db, "Overall", page_size=3)) == get_streak_data(self.db, "Overall")
+        assert list(iter_streaks(self.db, "Read", page_size=2)) == sorted(get_streak_data(self.db, "Read"))
+        # the pages of one habit are index range searches, not a sort of all its streaks per page
+        statements = []
+        self.db.set_trace_callback(statements.append)
+        list(iter_streaks(self.db, "Read", page_size=2))
+        self.db.set_trace_callback(None)
+        for statement in statements[:2]:
+            plan = [row[3] for row in self.db.execute("EXPLAIN QUERY PLAN " + statement)]
+            assert len(plan) == 1 and plan[0].startswith("SEARCH streaks USING INDEX idx_streaks_counter_date")
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestConcurrency:
+    def test_pool_connections(self, tmp_path):
+        pool = ConnectionPool(str(tmp_path / "pool.db"))
+        db = pool.connection()
+        assert db is pool.connection()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not db
+        # the connection of the finished thread is reused
+        thread = threading.Thread(target=lambda: other.append(pool.connection()))
+        thread.start()
+        thread.join()
+        assert other[1] is other[0]
+        pool.close()
+
+    def test_concurrent_checkoffs(self, tmp_path):
+        pool = ConnectionPool(str(tmp_path / "concurrent.db"))
+        habits = generate_habits(4)
+        for habit in habits:
+            habit.store(pool.connection())
+        days = [f"2024-03-{day:02d}" for day in range(1, 29)]
+        # every check-off is attempted three times from different threads
+        attempts = [(habit.name, day) for day in days for habit in habits for _ in range(3)]
+
+        def check_off(attempt):
+            return increment_counter(pool.connection(), *attempt)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(check_off, attempts))
+
+        db = pool.connection()
+        assert sum(results) == db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+        for habit in habits:
+            dates = [row[0] for row in get_last_check(db, habit.name)]
+            assert len(dates) == len(set(dates))
+        assert recompute(db, verify=True) == {}
+        pool.close()
+
+    def test_retry_on_busy(self):
+        calls = []
+
+        @retry_on_busy
+        def locked_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise sqlite3.OperationalError("database is locked")
+            return True
+
+        assert locked_twice()
+        assert len(calls) == 3
+
+
+class TestCheckoffQueue:
+    def test_grouped_checkoffs_match_single_checkoffs(self, tmp_path):
+        habits = generate_habits(5)
+        events = list(generate_events(habits, "2024-01-01", 60, probability=0.8, seed=4))
+        single = get_db(":memory:")
+        path = str(tmp_path / "queue.db")
+        grouped = get_db(path)
+        for habit in habits:
+            habit.store(single)
+            habit.store(grouped)
+        expected = [increment_counter(single, name, event_date) for name, event_date in events]
+
+        with CheckoffQueue(path, max_batch=50) as checkoffs:
+            futures = [checkoffs.submit(name, event_date) for name, event_date in events]
+            assert [future.result(timeout=10) for future in futures] == expected
+        assert_same_tables(single, grouped)
+        # readers of the same file see the committed groups through the shared cache
+        assert get_habit_info(grouped, "Read") == (get_habit_info(single, "Read")[0], "Daily")
+        single.close()
+        grouped.close()
+
+    def test_submit_from_many_threads(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        db = get_db(path)
+        for habit in generate_habits(5):
+            habit.store(db)
+        with CheckoffQueue(path) as checkoffs, ThreadPoolExecutor(max_workers=8) as executor:
+            futures = list(executor.map(lambda attempt: checkoffs.submit(*attempt),
+                                        [(name, "2024-01-01") for name, _, _ in SAMPLE_HABITS for _ in range(4)]))
+            assert sum(future.result(timeout=10) for future in futures) == 5
+        assert db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == 5
+        db.close()
+
+    def test_bad_checkoff_only_fails_itself(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        db = get_db(path)
+        HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(db)
+        # a long delay puts all three check-offs into one group
+        with CheckoffQueue(path, max_delay=0.5) as checkoffs:
+            futures = [checkoffs.submit("Read", "2024-01-01"), checkoffs.submit("Read", "2024-13-45"),
+                       checkoffs.submit("Read", "2024-01-02")]
+            assert futures[0].result(timeout=10)
+            with pytest.raises(ValueError):
+                futures[1].result(timeout=10)
+            assert futures[2].result(timeout=10)
+        assert get_last_check(db, "Read") == [("2024-01-01", "Read"), ("2024-01-02", "Read")]
+        with pytest.raises(RuntimeError):
+            checkoffs.submit("Read", "2024-01-03")
+        db.close()
+
+
+class TestHistory:
+    def setup_method(self):
+        self.db, self.habits, _ = habit_database(habits=6, years=2, probability=0.7, seed=9)
+        self.histories = load_histories(self.db)
+
+    def test_streaks_match_database(self):
+        for habit in self.habits:
+            history = self.histories[habit.name]
+            stats = get_habit_stats(self.db, habit.name)
+            assert len(history) == stats[3]
+            assert history.current_streak() == stats[2]
+            assert history.longest_streak() == max(stats[4], stats[2])
+            assert all(history.done_on(event_date) for event_date, _ in get_last_check(self.db, habit.name))
+
+    def test_small_history(self):
+        history = HabitHistory("Read", "Daily")
+        for event_date in ["2024-03-02", "2024-03-03", "2024-03-04", "2024-03-08", "2024-03-09", "2024-03-01"]:
+            history.add(event_date)
+        assert history.done_on("2024-03-01") and not history.done_on("2024-03-05")
+        assert history.longest_streak() == 4
+        assert history.current_streak() == 2
+        assert history.current_streak(on_date="2024-03-10") == 2
+        assert history.current_streak(on_date="2024-03-11") == 0
+        assert history.completions("2024-03-01", "2024-03-05") == 4
+        assert history.completion_rate("2024-03-01", "2024-03-10") == 0.6
+
+        weekly = HabitHistory("Clean House", "Weekly",
+                              [to_day("2024-03-01"), to_day("2024-03-08"), to_day("2024-03-16")])
+        assert weekly.longest_streak() == 2
+        assert weekly.current_streak() == 1
+        assert weekly.completion_rate("2024-03-01", "2024-03-14") == 1
+
+    def test_memory_footprint(self):
+        assert 0 < memory_footprint(self.histories) < 400 * len(self.histories)
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestScheduler:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        for habit in generate_habits(5):
+            habit.store(self.db)
+        increment_counter(self.db, "Read", "2024-01-01")
+        increment_counter(self.db, "Clean House", "2024-01-01")
+        increment_counter(self.db, "Drink Water", "2024-01-03")
+
+    def test_due_habits(self):
+        due = due_habits(self.db, "2024-01-02")
+        # habits that were never checked off are always due
+        assert [entry[0] for entry in due] == ["Call Family", "Exercise", "Read"]
+        assert due[2] == ("Read", "2024-01-02", "2024-01-03", False)
+        assert due_habits(self.db, "2024-01-09")[-1] == ("Clean House", "2024-01-08", "2024-01-09", True)
+        # the query only searches the index ranges of due habits
+        statements = []
+        self.db.set_trace_callback(statements.append)
+        due_habits(self.db, "2024-01-02")
+        self.db.set_trace_callback(None)
+        query = next(statement for statement in statements if "habit_stats" in statement)
+        plan = [row[3] for row in self.db.execute("EXPLAIN QUERY PLAN " + query)]
+        assert not [step for step in plan if step.startswith("SCAN")]
+        assert recompute(self.db, verify=True) == {}
+
+    def test_events_in_time_order(self):
+        scheduler = DueScheduler(self.db)
+        reminders, ended = [], []
+        fired = scheduler.run_until("2024-01-05", remind=lambda *event: reminders.append(event),
+                                    end_streak=lambda *event: ended.append(event))
+        assert fired == [("2024-01-02", "due", "Read"), ("2024-01-03", "break", "Read"),
+                         ("2024-01-04", "due", "Drink Water"), ("2024-01-05", "break", "Drink Water")]
+        assert reminders == [("Read", "2024-01-02"), ("Drink Water", "2024-01-04")]
+        assert ended == [("Read", "2024-01-03"), ("Drink Water", "2024-01-05")]
+
+        # a check-off before the queued event makes it obsolete, its new events are picked up later
+        increment_counter(self.db, "Clean House", "2024-01-08")
+        assert scheduler.run_until("2024-01-09") == []
+        assert scheduler.run_until("2024-01-16") == [("2024-01-15", "due", "Clean House"),
+                                                     ("2024-01-16", "break", "Clean House")]
+
+        # a back-dated check-off moves the events of a habit before the days that were processed already
+        increment_counter(self.db, "Exercise", "2024-01-10")
+        assert scheduler.run_until("2024-01-16") == [("2024-01-11", "due", "Exercise"),
+                                                     ("2024-01-12", "break", "Exercise")]
+        assert scheduler.run_until("2024-01-16") == []
+        # the same holds for bulk imports, while a repair that does not move any event fires nothing again
+        bulk_add_events(self.db, [("Call Family", "2024-01-03")])
+        recompute(self.db)
+        assert scheduler.run_until("2024-01-16") == [("2024-01-10", "due", "Call Family"),
+                                                     ("2024-01-11", "break", "Call Family")]
+        self.db.execute("UPDATE habit_stats SET total_checkoffs = 0")
+        self.db.commit()
+        assert recompute(self.db) and scheduler.run_until("2024-01-16") == []
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestRollups:
+    def setup_method(self):
+        self.db, self.habits, _ = habit_database(habits=4, years=2, probability=0.6, seed=5)
+
+    def expected(self, name, unit, start="0001-01-01", end="9999-12-31"):
+        counts = {}
+        for event_date, _ in get_last_check(self.db, name):
+            if start <= event_date <= end:
+                bucket = str(datetime.fromordinal(bucket_start(to_day(event_date), unit)).date())
+                counts[bucket] = counts.get(bucket, 0) + 1
+        return sorted(counts.items())
+
+    def test_counts_match_history(self):
+        for habit in self.habits:
+            for unit in ["day", "week", "month", "year"]:
+                result = rollup(self.db, habit.name, unit, today="2021-06-15")
+                assert [(bucket, count) for bucket, count, _ in result] == self.expected(habit.name, unit)
+                assert all(0 < rate <= 1 for _, _, rate in result)
+            # a date range cuts the periods at its edges
+            result = rollup(self.db, habit.name, "month", "2020-03-10", "2021-02-20", today="2021-01-05")
+            assert [(bucket, count) for bucket, count, _ in result] == \
+                self.expected(habit.name, "month", "2020-03-10", "2021-02-20")
+        assert rollup(self.db, "Unknown") is None
+        assert set(rollups(self.db, "year")) == {habit.name for habit in self.habits}
+
+    def test_completion_rate(self):
+        db = get_db(":memory:")
+        for habit in generate_habits(4):
+            habit.store(db)
+        for event_date in ["2024-01-01", "2024-01-02", "2024-01-04"]:
+            increment_counter(db, "Read", event_date)
+        increment_counter(db, "Clean House", "2024-01-01")
+        assert rollup(db, "Read", "week") == [("2024-01-01", 3, 3 / 7)]
+        assert rollup(db, "Read", "week", end="2024-01-04") == [("2024-01-01", 3, 3 / 4)]
+        assert rollup(db, "Clean House", "month") == [("2024-01-01", 1, 1 / 5)]
+        db.close()
+
+    def test_closed_periods_are_cached(self):
+        name = self.habits[0].name
+        first = rollup(self.db, name, "week", today="2021-06-15")
+        hits = self.db.cache.stats()["hits"]
+        assert rollup(self.db, name, "week", today="2021-06-15") == first
+        assert self.db.cache.stats()["hits"] == hits + 1
+        # a check-off drops the cached periods of the habit
+        increment_counter(self.db, name, "2022-01-10")
+        assert rollup(self.db, name, "week", today="2021-06-15") == first + [("2022-01-10", 1, 1 / 7)]
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestReport:
+    def test_render_and_skip_unchanged(self, tmp_path):
+        path = str(tmp_path / "user.db")
+        db, habits, _ = build_database(path, habits=3, years=1, probability=0.8, seed=2)
+        output = str(tmp_path / "reports")
+        rendered, skipped = render_reports([path], output, formats=("png", "svg"), workers=2)
+        assert len(rendered) == 3 * 2 * 2 and skipped == []
+        assert all(os.path.getsize(chart) > 0 for chart in rendered)
+        subdirectory = os.path.dirname(rendered[0])
+        assert os.path.basename(subdirectory).startswith("user-")
+        assert os.path.exists(os.path.join(subdirectory, f"{file_stem('Drink Water')}-calendar.svg"))
+
+        # only the charts of the habit that changed are rendered again
+        increment_counter(db, "Read", "2021-01-10")
+        rendered, skipped = render_reports([path], output, formats=("png", "svg"), workers=2)
+        assert sorted(os.path.basename(chart) for chart in rendered) == \
+            ["Read-calendar.png", "Read-calendar.svg", "Read-streaks.png", "Read-streaks.svg"]
+        assert len(skipped) == 8
+
+        assert main(["--db", path, "report", "--output", output]) == 0
+        db.close()
+
+    def test_distinct_file_names(self, tmp_path):
+        assert file_stem("Read") == "Read"
+        assert len({file_stem("A B"), file_stem("A_B"), file_stem("A/B")}) == 3
+        # databases with the same file name in different directories get their own sub directories
+        paths = []
+        for user in ["alice", "bob"]:
+            os.makedirs(tmp_path / user)
+            paths.append(str(tmp_path / user / "main.db"))
+            db = get_db(paths[-1])
+            HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(db)
+            increment_counter(db, "Read", "2024-01-01")
+            db.close()
+        rendered, _ = render_reports(paths, str(tmp_path / "reports"), workers=1)
+        assert len(rendered) == 2 and os.path.dirname(rendered[0]) != os.path.dirname(rendered[1])
+
+
+class TestSnapshot:
+    def setup_method(self):
+        self.db, self.habits, _ = habit_database(habits=5, years=1, probability=0.7, seed=4)
+
+    def test_export_and_load(self, tmp_path):
+        tracker_rows = self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+        assert export_snapshot(self.db, str(tmp_path)) == {"tracker": tracker_rows,
+                                                           "streaks": len(get_streak_data(self.db, "Overall"))}
+        snapshot = load_snapshot(str(tmp_path))
+        assert isinstance(snapshot.tracker["day"], numpy.memmap)
+        for habit in self.habits:
+            assert [str(datetime.fromordinal(day).date()) for day in snapshot.days(habit.name)] == \
+                [event_date for event_date, _ in get_last_check(self.db, habit.name)]
+        assert snapshot.streaks["length"].sum() == sum(row[2] for row in get_streak_data(self.db, "Overall"))
+
+    def test_append_only_new_rows(self, tmp_path):
+        export_snapshot(self.db, str(tmp_path))
+        HabitCounter("Meditate", "Meditate for 10 minutes", "Daily").store(self.db)
+        increment_counter(self.db, "Meditate", "2021-01-01")
+        increment_counter(self.db, "Read", "2021-01-01")
+        assert export_snapshot(self.db, str(tmp_path)) == {"tracker": 2, "streaks": 1}
+        snapshot = load_snapshot(str(tmp_path))
+        # the appended rows are merged into the column files, which are still memory-mapped
+        assert all(isinstance(column, numpy.memmap) for column in [*snapshot.tracker.values(),
+                                                                    *snapshot.streaks.values()])
+        assert snapshot.days("Meditate").tolist() == [to_day("2021-01-01")]
+        assert len(snapshot.tracker["name"]) == self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+        assert sorted(os.listdir(tmp_path)) == ["000001", "meta.json"]
+
+        # a deleted habit makes the next export start over
+        delete_habit(self.db, "Meditate")
+        assert export_snapshot(self.db, str(tmp_path))["tracker"] == len(snapshot.tracker["name"]) - 1
+        assert load_snapshot(str(tmp_path)).meta["generation"] == 2
+        assert main(["--db", ":memory:", "snapshot", str(tmp_path), "--restore"]) == 0
+
+    def test_interrupted_export_keeps_snapshot(self, tmp_path, monkeypatch):
+        export_snapshot(self.db, str(tmp_path))
+        increment_counter(self.db, "Read", "2021-01-01")
+        monkeypatch.setattr(numpy, "savez", lambda *args, **kwargs: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            export_snapshot(self.db, str(tmp_path), append=False)
+        snapshot = load_snapshot(str(tmp_path))
+        assert len(snapshot.tracker["day"]) == self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] - 1
+        monkeypatch.undo()
+        assert export_snapshot(self.db, str(tmp_path))["tracker"] == 1
+
+    def test_recompute_rewrites_snapshot(self, tmp_path):
+        self.db.execute("UPDATE streaks SET length = length + 5 WHERE rowid = 1")
+        self.db.commit()
+        export_snapshot(self.db, str(tmp_path))
+        # recompute deletes and re-inserts the streaks, so their number and rowids stay the same
+        assert recompute(self.db)
+        assert export_snapshot(self.db, str(tmp_path))["streaks"] == len(get_streak_data(self.db, "Overall"))
+        snapshot = load_snapshot(str(tmp_path))
+        assert snapshot.streaks["length"].sum() == sum(row[2] for row in get_streak_data(self.db, "Overall"))
+        assert export_snapshot(self.db, str(tmp_path)) == {"tracker": 0, "streaks": 0}
+
+    def test_import_restores_database(self, tmp_path):
+        export_snapshot(self.db, str(tmp_path))
+        restored = get_db(":memory:")
+        assert import_snapshot(restored, str(tmp_path)) == self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+        assert_same_tables(restored, self.db)
+        with pytest.raises(ValueError):
+            import_snapshot(restored, str(tmp_path))
+        restored.close()
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestSharding:
+    def test_users_have_separate_databases(self, tmp_path):
+        router = ShardRouter(str(tmp_path), max_open=2)
+        for user_id, days in [("alice", 3), ("bob", 5), ("carol", 1)]:
+            with router.connection(user_id) as db:
+                HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(db)
+                for day in range(days):
+                    HabitCounter("Read", "", "").add_event(db, f"2024-01-{day + 1:02d}")
+                HabitCounter("Read", "", "").add_event(db, "2024-02-01")  # ends the streak
+        # only the two most recently used databases keep their connections open
+        assert len(router.pools) == 2
+        assert router.users() == ["alice", "bob", "carol"]
+        with router.connection("alice") as db:
+            assert get_habit_stats(db, "Read")[3] == 4
+
+        assert router.leaderboard(limit=2) == [("bob", "Read", 5, "2024-02-01"), ("alice", "Read", 3, "2024-02-01")]
+        assert set(router.migrate().values()) == {MIGRATIONS[-1][0]}
+        router.close()
+
+        with pytest.raises(ValueError):
+            router.path_for("../alice")
+
+    def test_hash_buckets(self, tmp_path):
+        router = ShardRouter(str(tmp_path), buckets=4)
+        assert router.path_for("alice") == router.path_for("alice") != router.path_for("bob")
+        for user_id in ["alice", "bob", "carol", "dave"]:
+            with router.connection(user_id):
+                pass
+        assert router.users() == ["alice", "bob", "carol", "dave"]
+        assert all(os.path.dirname(router.path_for(user_id)) != str(tmp_path) for user_id in router.users())
+        router.close()
+
+    def test_concurrent_checkoffs(self, tmp_path):
+        # more users than open databases, so databases are evicted while other threads use them
+        router = ShardRouter(str(tmp_path), max_open=1)
+        users = ["alice", "bob", "carol"]
+        for user_id in users:
+            with router.connection(user_id) as db:
+                HabitCounter("Read", "Read for at least 30 minutes", "Daily").store(db)
+        days = [f"2024-03-{day:02d}" for day in range(1, 29)]
+        attempts = [(user_id, day) for day in days for user_id in users for _ in range(5)]
+
+        def check_off(attempt):
+            with router.connection(attempt[0]) as db:
+                return increment_counter(db, "Read", attempt[1])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(check_off, attempts))
+
+        assert sum(results) == len(users) * len(days)
+        for user_id in users:
+            with router.connection(user_id) as db:
+                assert get_habit_stats(db, "Read")[3] == len(days)
+        router.close()
+
+
+class TestMetrics:
+    def setup_method(self):
+        self.db = get_db(":memory:")
+        for habit in generate_habits(3):
+            habit.store(self.db)
+        metrics.reset()
+
+    def test_disabled_by_default(self):
+        increment_counter(self.db, "Read", "2024-01-01")
+        assert metrics.collect() == {}
+
+    def test_operations_are_recorded(self):
+        metrics.enable()
+        try:
+            for day in range(1, 6):
+                increment_counter(self.db, "Read", f"2024-01-{day:02d}")
+            increment_counter(self.db, "Read", "2024-01-05")
+            get_habit_info(self.db, "Read")
+        finally:
+            metrics.disable()
+        collected = metrics.collect()
+        checkoffs = collected["increment_counter"]
+        assert checkoffs["calls"] == 6 and checkoffs["errors"] == 0
+        assert checkoffs["histogram"]["+Inf"] == 6
+        assert checkoffs["statements"] >= 6 * 2 and checkoffs["vm_steps"] > 0
+        assert collected["get_habit_info"]["calls"] == 1
+
+        text = metrics.to_prometheus()
+        assert 'habit_operation_seconds_count{operation="increment_counter"} 6' in text
+        assert 'habit_operation_seconds_bucket{operation="increment_counter",le="+Inf"} 6' in text
+        assert json.loads(metrics.to_json())["increment_counter"]["calls"] == 6
+
+    def test_metrics_command_line(self, tmp_path, capsys):
+        path = str(tmp_path / "metrics.db")
+        get_db(path).close()
+        output = str(tmp_path / "metrics.prom")
+        assert main(["--db", path, "--metrics", "prometheus", "--metrics-output", output, "list"]) == 0
+        with open(output) as file:
+            assert 'habit_operation_seconds_count{operation="get_all_counter_data"} 2' in file.read()
+        capsys.readouterr()
+        assert main(["--db", path, "--metrics", "json", "checkoff", "Read"]) == 1
+        assert "The habit 'Read' cannot be checked off" in capsys.readouterr().out
+        assert not metrics.enabled
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestFixtures:
+    def test_clones_are_isolated_and_deterministic(self):
+        first, habits, accepted = habit_database(habits=3, years=1)
+        second, _, _ = habit_database(habits=3, years=1)
+        assert first.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == accepted
+        for query in ["SELECT * FROM tracker ORDER BY rowid", f"SELECT {STATS_COLUMNS} FROM habit_stats ORDER BY name"]:
+            assert first.execute(query).fetchall() == second.execute(query).fetchall()
+
+        delete_habit(first, habits[0].name)
+        assert get_habit_stats(second, habits[0].name) is not None
+        assert get_habit_stats(template_database(habits=3, years=1)[0], habits[0].name) is not None
+        assert template_database(habits=3, years=1) is template_database(habits=3, years=1)
+        first.close()
+        second.close()
+
+    def test_clone_to_file(self, tmp_path):
+        db, habits, _ = habit_database(str(tmp_path / "clone.db"), habits=2, years=1)
+        assert increment_counter(db, habits[0].name, "2022-01-01")
+        assert recompute(db, verify=True) == {}
+        db.close()
+
+
+class TestArchive:
+    def setup_method(self):
+        self.db, self.habits, _ = habit_database(habits=4, years=2, probability=0.6, seed=7)
+
+    def test_history_reads_include_archive(self, tmp_path):
+        names = [habit.name for habit in self.habits]
+        checkoffs = {name: sorted(get_last_check(self.db, name)) for name in names}
+        months = {name: rollup(self.db, name, "month", today="2021-06-01") for name in names}
+        histories = load_histories(self.db)
+        live = self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+
+        archived = archive_history(self.db, "2021-03-01")
+        assert 0 < archived < live
+        assert self.db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == live - archived
+        assert recompute(self.db, verify=True) == {}
+        for name in names:
+            assert sorted(get_last_check(self.db, name)) == checkoffs[name]
+            assert list(iter_checkoffs(self.db, name, page_size=7)) == checkoffs[name]
+            assert list(iter_checkoffs(self.db, name, start="2021-02-01", limit=20)) == \
+                [row for row in checkoffs[name] if row[0] >= "2021-02-01"][:20]
+            assert rollup(self.db, name, "month", today="2021-06-01") == months[name]
+            assert load_histories(self.db)[name].bits == histories[name].bits
+
+        export_snapshot(self.db, str(tmp_path))
+        assert len(load_snapshot(str(tmp_path)).tracker["day"]) == live
+
+    def test_writes_after_archival(self):
+        name = self.habits[0].name
+        archive_history(self.db, "2021-12-01")
+        assert increment_counter(self.db, name, "2022-01-05")
+        assert recompute(self.db, verify=True) == {}
+        delete_habit(self.db, name)
+        assert self.db.execute("SELECT COUNT(*) FROM archive WHERE name = ?", (name,)).fetchone()[0] == 0
+
+    def test_compact(self, tmp_path):
+        path = str(tmp_path / "archive.db")
+        db, _, _ = habit_database(path, habits=4, years=2, probability=0.6, seed=7)
+        archive_history(db, "2021-12-01")
+        assert compact(db) > 0
+        assert db.execute("PRAGMA freelist_count").fetchone()[0] == 0
+        assert db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        db.close()
+        assert main(["--db", path, "archive", "--before", "2022-01-01"]) == 0
+
+    def teardown_method(self):
+        self.db.close()
+
+
+class TestMaintenance:
+    def setup_method(self):
+        self.messages = []
+
+    def create_databases(self, tmp_path):
+        paths = []
+        for number in range(3):
+            path = str(tmp_path / f"user{number}" / "main.db")
+            os.makedirs(os.path.dirname(path))
+            habit_database(path, habits=3, years=1)[0].close()
+            paths.append(path)
+        db = sqlite3.connect(paths[1])
+        db.execute("INSERT INTO tracker (date, counterName) VALUES (?, ?)", (to_day("2024-01-01"), "Deleted"))
+        db.commit()
+        db.close()
+        return paths
+
+    def test_jobs(self, tmp_path):
+        paths = self.create_databases(tmp_path)
+        assert discover([str(tmp_path)]) == paths
+
+        results = run_maintenance([str(tmp_path)], "integrity", workers=2, progress=self.messages.append)
+        assert [results[path]["status"] for path in paths] == ["ok", "failed", "ok"]
+        assert "tracker row" in results[paths[1]]["detail"] and len(self.messages) == 3
+
+        results = run_maintenance([str(tmp_path)], "orphans", workers=2, progress=self.messages.append)
+        assert results[paths[1]]["detail"].startswith("1 tracker")
+        for job in ["integrity", "recompute", "vacuum"]:
+            results = run_maintenance(paths, job, workers=2, progress=self.messages.append)
+            assert all(result["status"] == "ok" for result in results.values())
+        assert results[paths[0]]["seconds"] > 0
+
+    def test_orphans_in_old_layout(self, tmp_path):
+        # a file written before the migrations, with the rows of a habit deleted by an older delete_habit
+        path = str(tmp_path / "old.db")
+        create_baseline_database(path)
+        # the integrity job only reads, so it reports the orphaned rows without migrating the file
+        result = run_maintenance([path], "integrity", workers=1, progress=self.messages.append)[path]
+        assert result["status"] == "failed" and "streaks row 1 references a missing counter" in result["detail"]
+        assert get_schema_version(sqlite3.connect(path)) == 0
+        result = run_maintenance([path], "orphans", workers=1, progress=self.messages.append)[path]
+        assert result["status"] == "ok"
+        assert result["detail"].startswith("2 tracker, 1 streaks")
+        assert run_maintenance([path], "integrity", workers=1, progress=self.messages.append)[path]["status"] == "ok"
+
+    def test_skips_other_databases(self, tmp_path):
+        path = str(tmp_path / "other.db")
+        other = sqlite3.connect(path)
+        other.execute("CREATE TABLE notes (text TEXT)")
+        other.commit()
+        other.close()
+        for job in JOBS:
+            assert run_maintenance([path], job, workers=1, progress=self.messages.append)[path]["status"] == "skipped"
+        other = sqlite3.connect(path)
+        assert [row[0] for row in other.execute("SELECT name FROM sqlite_master")] == ["notes"]
+        assert other.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        other.close()
+
+    def test_resume(self, tmp_path):
+        paths = self.create_databases(tmp_path)
+        state = str(tmp_path / "state.json")
+        with open(state, "w") as file:
+            json.dump({"job": "orphans", "done": {paths[0]: {"status": "ok", "seconds": 0.1}}}, file)
+        results = run_maintenance(paths, "orphans", workers=2, state_file=state, progress=self.messages.append)
+        assert sorted(results) == paths[1:]
+        assert self.messages[0] == "Skipping 1 files already maintained by an earlier run."
+        assert run_maintenance(paths, "orphans", state_file=state, progress=self.messages.append) == {}
+        # another job starts over
+        assert main(["maintain", "integrity", str(tmp_path), "--state", state, "--workers", "2"]) == 0
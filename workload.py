@@ -0,0 +1,69 @@
+import random
+from datetime import date, timedelta
+from class_counter import HabitCounter
+from db import get_db
+from bulk import bulk_add_events
+
+# the habits the test suite has always used; generated workloads start with them
+SAMPLE_HABITS = [("Drink Water", "Drink at least 8 glasses of water", "Daily"),
+                 ("Read", "Read for at least 30 minutes", "Daily"),
+                 ("Exercise", "Do some form of exercise", "Daily"),
+                 ("Clean House", "Weekly house cleaning", "Weekly"),
+                 ("Call Family", "Call family members", "Weekly")]
+
+
+def generate_habits(count):
+    """
+    Creates a number of HabitCounter instances, starting with the sample habits and continuing with numbered daily
+    and weekly habits.
+
+    :param count: The number of habits to create.
+    :return: A list of HabitCounter instances (not stored yet).
+    """
+    habits = [HabitCounter(*habit) for habit in SAMPLE_HABITS[:count]]
+    for number in range(len(habits), count):
+        period = "Daily" if number % 2 == 0 else "Weekly"
+        habits.append(HabitCounter(f"Habit {number}", f"Generated {period.lower()} habit", period))
+    return habits
+
+
+def generate_events(habits, start_date, days, probability=0.5, seed=None):
+    """
+    Generates random check-off attempts, day by day, for every habit.
+
+    :param habits: The HabitCounter instances to generate events for.
+    :param start_date: The first day as a "YYYY-MM-DD" string.
+    :param days: The number of days to generate.
+    :param probability: The chance that a habit is checked off on a given day.
+    :param seed: Seed of the random generator. The same seed always generates the same events.
+    :return: A generator of (name, date) tuples in day order.
+    """
+    rng = random.Random(seed)
+    first_day = date.fromisoformat(start_date)
+    for day in range(days):
+        event_date = str(first_day + timedelta(days=day))
+        for habit in habits:
+            # Randomly skip some days for daily and weekly habits
+            if rng.random() < probability:
+                yield habit.name, event_date
+
+
+def build_database(name, habits=5, years=1, probability=0.5, seed=0, start_date="2020-01-01"):
+    """
+    Creates a database filled with a synthetic workload of N habits x Y years of check-off attempts.
+
+    :param name: The database file name, or ":memory:".
+    :param habits: The number of habits.
+    :param years: The number of years of history.
+    :param probability: The chance that a habit is checked off on a given day.
+    :param seed: Seed of the random generator.
+    :param start_date: The first day of the history as a "YYYY-MM-DD" string.
+    :return: A tuple (db, habits, accepted) with the open connection, the stored HabitCounter instances and the number
+             of check-offs that were accepted.
+    """
+    db = get_db(name)
+    counters = generate_habits(habits)
+    for counter in counters:
+        counter.store(db)
+    accepted, _ = bulk_add_events(db, generate_events(counters, start_date, years * 365, probability, seed))
+    return db, counters, accepted
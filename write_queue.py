@@ -0,0 +1,133 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date
+from cache import invalidate
+from db import get_db, apply_checkoff, retry_on_busy
+
+_STOP = object()
+
+
+class CheckoffQueue:
+    def __init__(self, name="test.db", max_batch=500, max_delay=0.005):
+        """
+        Opt-in write path for high-frequency check-offs. Check-offs submitted from any thread are applied in order by
+        one writer thread with the usual check-off rules and committed in groups, so many check-offs share one commit.
+
+        :param name: The database file name.
+        :param max_batch: The maximum number of check-offs committed together.
+        :param max_delay: The maximum time in seconds a check-off waits for others to join its group.
+        """
+        self.name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+        self.closed = False
+        self.lock = threading.Lock()  # makes submit and close agree on whether the queue is still open
+        self.writer = threading.Thread(target=self._run, name="checkoff-queue", daemon=True)
+        self.writer.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, name, event_date=None):
+        """
+        Queues a check-off.
+
+        :param name: The name of the habit to check off.
+        :param event_date: Optional. The date of the event as "YYYY-MM-DD", defaults to today's date.
+        :return: A Future whose result is True if the check-off was accepted and False if it was not allowed, once
+                 its group has been committed.
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The check-off queue is closed.")
+            self.pending.put((name, event_date or str(date.today()), future))
+        return future
+
+    def close(self):
+        """
+        Applies all queued check-offs, then stops the writer thread and closes its connection.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.pending.put(_STOP)
+        self.writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        try:
+            db = get_db(self.name)
+        except Exception as error:
+            self.error = error
+            self.ready.set()
+            return
+        self.ready.set()
+
+        stop = False
+        while not stop:
+            item = self.pending.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            # collect more check-offs until the group is full or the first one has waited long enough
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(db, batch)
+        db.close()
+
+    def _commit(self, db, batch):
+        try:
+            results = _apply_batch(db, [(name, event_date) for name, event_date, _ in batch])
+        except Exception as error:
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+@retry_on_busy
+def _apply_batch(db, checkoffs):
+    # every check-off runs in its own savepoint, so a bad one (e.g. a malformed date) only fails its own future;
+    # errors of the database itself still fail the whole group
+    results = []
+    with db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for name, event_date in checkoffs:
+            cur.execute("SAVEPOINT checkoff")
+            try:
+                results.append(apply_checkoff(cur, name, event_date))
+            except sqlite3.OperationalError:
+                raise
+            except Exception as error:
+                cur.execute("ROLLBACK TO checkoff")
+                results.append(error)
+            cur.execute("RELEASE checkoff")
+    for name in {name for (name, _), result in zip(checkoffs, results) if result is True}:
+        invalidate(db, name)
+    return results